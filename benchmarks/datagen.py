@@ -0,0 +1,73 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from valleorm import models
+
+
+FIRST_NAMES = ["ana", "bruno", "carla", "diego", "elena", "fran", "gema", "hugo",
+               "irene", "jorge", "lucia", "mario", "nuria", "oscar", "paula", "raul"]
+LAST_NAMES = ["garcia", "lopez", "martin", "sanchez", "perez", "gomez", "ruiz", "diaz",
+              "moreno", "alvarez", "romero", "navarro", "torres", "dominguez"]
+INSTRUMENTS = ["guitar", "bass", "drums", "piano", "violin", "banjo", "sax", "flute"]
+WORDS = ["blue", "night", "road", "river", "fire", "song", "city", "dream", "stone",
+         "light", "rain", "heart", "wild", "gold", "sun", "moon"]
+
+
+class Instrument(models.Model):
+    name = models.CharField(max_length=50)
+
+
+class Musician(models.Model):
+    first_name = models.CharField(max_length=50, db_index=True)
+    last_name = models.CharField(max_length=50)
+    email = models.EmailField()
+    num_stars = models.IntegerField()
+    instrument = models.ManyToManyField("Instrument")
+
+
+class Album(models.Model):
+    artist = models.ForeignKey(Musician, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    release_date = models.DateField()
+    num_stars = models.IntegerField()
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+
+MODELS = [Instrument, Musician, Album]
+
+
+def use_database(db_name):
+    for m in MODELS:
+        m.DB_NAME = db_name
+
+
+def new_musician(rnd):
+    first_name = rnd.choice(FIRST_NAMES)
+    last_name = rnd.choice(LAST_NAMES)
+    return Musician(first_name=first_name, last_name=last_name,
+                    email="%s.%s%d@example.com" % (first_name, last_name, rnd.randint(0, 9999)),
+                    num_stars=rnd.randint(0, 5))
+
+
+def new_album(rnd, artist_id):
+    return Album(artist_id=artist_id,
+                 name=" ".join(rnd.sample(WORDS, 3)),
+                 release_date=date(1960, 1, 1) + timedelta(days=rnd.randint(0, 22000)),
+                 num_stars=rnd.randint(0, 5),
+                 price=Decimal("%d.%02d" % (rnd.randint(5, 30), rnd.randint(0, 99))))
+
+
+def populate(rows, seed=0, albums_per_musician=3, linked=1000):
+    rnd = random.Random(seed)
+    models.migrate_models(models=MODELS)
+    instruments = Instrument.bulk_create([Instrument(name=name) for name in INSTRUMENTS])
+    musicians = Musician.bulk_create([new_musician(rnd) for i in range(rows)])
+    Album.bulk_create([new_album(rnd, rnd.choice(musicians).id)
+                       for i in range(rows * albums_per_musician)])
+    with models.atomic(Musician):
+        for m in musicians[:linked]:
+            for instrument in rnd.sample(instruments, 2):
+                m.instrument.add(instrument)
+    return {"musicians": rows, "albums": rows * albums_per_musician,
+            "instruments": len(instruments), "linked": min(linked, rows)}
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+from valleorm import models
+import datagen
+from datagen import Musician, Album, MODELS
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=200):
+    def wrap(func):
+        BENCHMARKS.append((name, func, repeat))
+        return func
+    return wrap
+
+
+class Context(object):
+    def __init__(self, rows, seed, workdir, db_name):
+        self.rows = rows
+        self.seed = seed
+        self.workdir = workdir
+        self.db_name = db_name
+        self.migrations = 0
+        self.rnd = random.Random(seed)
+        self.musician_ids = []
+        self.albums = []
+        self.musicians = []
+
+    def load(self):
+        self.musician_ids = list(Musician.filter().values_list("id", flat=True))
+        self.albums = list(Album.filter().limit(1000))
+        self.musicians = list(Musician.filter().limit(1000))
+
+
+@benchmark("get_by_pk", repeat=2000)
+def get_by_pk(ctx):
+    Musician.getByPk(ctx.rnd.choice(ctx.musician_ids))
+    return 1
+
+
+@benchmark("filter_exact")
+def filter_exact(ctx):
+    list(Musician.filter(last_name=ctx.rnd.choice(datagen.LAST_NAMES)).limit(100))
+    return 1
+
+
+@benchmark("filter_between")
+def filter_between(ctx):
+    low = ctx.rnd.randint(0, 4)
+    list(Musician.filter(num_stars__between=(low, low + 1)).limit(100))
+    return 1
+
+
+@benchmark("filter_gte")
+def filter_gte(ctx):
+    list(Musician.filter(num_stars__gte=ctx.rnd.randint(0, 5)).limit(100))
+    return 1
+
+
+@benchmark("filter_lte")
+def filter_lte(ctx):
+    list(Musician.filter(num_stars__lte=ctx.rnd.randint(0, 5)).limit(100))
+    return 1
+
+
+@benchmark("filter_start")
+def filter_start(ctx):
+    list(Musician.filter(first_name__start=ctx.rnd.choice(datagen.FIRST_NAMES)[:2]).limit(100))
+    return 1
+
+
+@benchmark("filter_end")
+def filter_end(ctx):
+    list(Musician.filter(last_name__end=ctx.rnd.choice(datagen.LAST_NAMES)[-2:]).limit(100))
+    return 1
+
+
+@benchmark("filter_contain")
+def filter_contain(ctx):
+    list(Musician.filter(email__contain=ctx.rnd.choice(datagen.LAST_NAMES)[1:4]).limit(100))
+    return 1
+
+
+@benchmark("filter_in")
+def filter_in(ctx):
+    list(Musician.filter(id__in=ctx.rnd.sample(ctx.musician_ids, 50)))
+    return 1
+
+
+@benchmark("filter_fk")
+def filter_fk(ctx):
+    list(Album.filter(artist_id__fk=ctx.rnd.choice(ctx.musician_ids)))
+    return 1
+
+
+@benchmark("foreign_key", repeat=1000)
+def foreign_key(ctx):
+    ctx.rnd.choice(ctx.albums).artist.get()
+    return 1
+
+
+@benchmark("one_to_many", repeat=1000)
+def one_to_many(ctx):
+    list(ctx.rnd.choice(ctx.musicians).album.get())
+    return 1
+
+
+@benchmark("many_to_many", repeat=1000)
+def many_to_many(ctx):
+    list(ctx.rnd.choice(ctx.musicians).instrument.get())
+    return 1
+
+
+@benchmark("to_dict", repeat=20)
+def to_dict(ctx):
+    for m in ctx.albums:
+        m.toDICT()
+    return len(ctx.albums)
+
+
+@benchmark("to_json", repeat=20)
+def to_json(ctx):
+    for m in ctx.albums:
+        m.toJSON()
+    return len(ctx.albums)
+
+
+@benchmark("insert_single", repeat=500)
+def insert_single(ctx):
+    datagen.new_musician(ctx.rnd).save()
+    return 1
+
+
+@benchmark("bulk_create", repeat=10)
+def bulk_create(ctx):
+    return len(Musician.bulk_create([datagen.new_musician(ctx.rnd) for i in range(1000)]))
+
+
+@benchmark("migrate_models", repeat=20)
+def migrate_models(ctx):
+    ctx.migrations += 1
+    db_name = os.path.join(ctx.workdir, "migrate_%d.sqlite3" % ctx.migrations)
+    datagen.use_database(db_name)
+    try:
+        models.migrate_models(models=MODELS)
+    finally:
+        datagen.use_database(ctx.db_name)
+        models.connections.close_all(db_name)
+    return 1
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+
+def measure(func, ctx, repeat, memory_repeat):
+    latencies = []
+    ops = 0
+    start = time.perf_counter()
+    for i in range(repeat):
+        t = time.perf_counter()
+        ops += func(ctx)
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for i in range(min(repeat, memory_repeat)):
+        func(ctx)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    return {"calls": repeat, "ops": ops, "seconds": round(total, 6),
+            "ops_per_sec": round(ops / total, 2) if total else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 4),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+            "max_ms": round(max(latencies) * 1000, 4),
+            "peak_kb": round(peak / 1024.0, 1)}
+
+
+def compare(results, path):
+    with open(path) as f:
+        base = json.load(f)["results"]
+    print("")
+    print("%-16s %14s %14s %8s" % ("compare", "base ops/s", "ops/s", "ratio"))
+    for name, r in results.items():
+        if name in base and base[name]["ops_per_sec"] and r["ops_per_sec"]:
+            print("%-16s %14.1f %14.1f %7.2fx" % (name, base[name]["ops_per_sec"], r["ops_per_sec"],
+                                                 r["ops_per_sec"] / base[name]["ops_per_sec"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="valleorm benchmarks")
+    parser.add_argument("--rows", type=int, default=10000, help="musicians generated, albums are 3x")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the repeat count of every benchmark")
+    parser.add_argument("--memory-repeat", type=int, default=20, help="calls traced with tracemalloc")
+    parser.add_argument("--profile", default="default", choices=sorted(models.PROFILES))
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON file of a previous run")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="valleorm-bench-")
+    db_name = os.path.join(workdir, "bench.sqlite3")
+    only = args.only.split(",") if args.only else None
+    try:
+        models.connections.configure(db_name, profile=args.profile)
+        datagen.use_database(db_name)
+        start = time.perf_counter()
+        counts = datagen.populate(args.rows, args.seed)
+        print("populate %s in %.2fs" % (counts, time.perf_counter() - start))
+
+        ctx = Context(args.rows, args.seed, workdir, db_name)
+        ctx.load()
+        results = {}
+        print("%-16s %8s %12s %10s %10s %10s %10s" % ("benchmark", "calls", "ops/s", "p50 ms",
+                                                     "p90 ms", "p99 ms", "peak KB"))
+        for i, (name, func, repeat) in enumerate(BENCHMARKS):
+            if only and name not in only:
+                continue
+            ctx.rnd = random.Random(args.seed + i)
+            r = results[name] = measure(func, ctx, max(1, int(repeat * args.scale)), args.memory_repeat)
+            print("%-16s %8d %12.1f %10.3f %10.3f %10.3f %10.1f" % (name, r["calls"], r["ops_per_sec"],
+                                                                   r["p50_ms"], r["p90_ms"], r["p99_ms"],
+                                                                   r["peak_kb"]))
+    finally:
+        models.connections.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        report = {"meta": {"date": datetime.now().isoformat(), "python": platform.python_version(),
+                           "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+                           "rows": args.rows, "seed": args.seed, "profile": args.profile,
+                           "scale": args.scale},
+                  "results": results}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
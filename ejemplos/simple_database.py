@@ -83,27 +83,29 @@ def create_person_data():
 def create_musician_data(r):
    
    instruments = ["accordion", "acoustic guitar", "bagpipes", "banjo"]
+   musicians = []
    for i in range(0,r):
-      random.seed()
-      print("Creando musician %s" % i+1)
       m = Musician()
       m.first_name = names.get_first_name()
       m.last_name = names.get_last_name()
       m.instrument = random.choice(instruments)
-      m.save()
-      print()
-      cerate_album_data(m)
-
-def cerate_album_data(m):
-   r = random.randint(0, 10)
-   for i in range(0, r):
-      print("Creando album %s" % i+1)
-      random.seed()
-      a = Album()
-      a.name = names.get_first_name()
-      a.num_stars = random.randint(0,10)
-      a.release_date = datetime.datetime.now()
-      m.album.add(a)
+      musicians.append(m)
+   print("Creando %s musicians" % r)
+   Musician.bulk_create(musicians)
+   cerate_album_data(musicians)
+
+def cerate_album_data(musicians):
+   albums = []
+   for m in musicians:
+      for i in range(0, random.randint(0, 10)):
+         a = Album()
+         a.artist_id = m.id
+         a.name = names.get_first_name()
+         a.num_stars = random.randint(0,10)
+         a.release_date = datetime.datetime.now()
+         albums.append(a)
+   print("Creando %s albums" % len(albums))
+   Album.bulk_create(albums)
 
 
 if __name__ == "__main__":
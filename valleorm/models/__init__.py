@@ -9,7 +9,16 @@ from .constant import *
 from .fields import *
 from .relatedfields import *
 from .model import Model
-from .tools import Utility, Q
+from .queryset import QuerySet
+from .indexes import Index
+from .aggregates import Count, Sum, Avg, Min, Max
+from .tools import Utility, Q, atomic
+from .connection import connections, PROFILES
+from .cache import session, query_cache
+from .instrumentation import instrumentation, SlowQueryLogger, QueryCounter, assert_num_queries
+from .explain import QueryPlan, index_advisor
+from .writer import WriterService, WriterClient, writers
+from .router import router, Snapshot, read_only_uri
 from .qsonhelper import QSonHelper
 
 
@@ -18,4 +27,6 @@ def migrate_models(alter=False, models=[]):
     for m in models:
         if alter or not Utility.exists_table(Utility.default_tb_name(m), Utility.default_db_name(m)):
             m.init_model()
+        else:
+            m.create_indexes()
             
@@ -0,0 +1,38 @@
+class Aggregate(object):
+    function = None
+
+    def __init__(self, field, distinct=False):
+        self.field = field
+        self.distinct = distinct
+
+    def default_alias(self):
+        return "%s__%s" % (self.field.replace(".", "_").replace("*", "all"), self.function.lower())
+
+    def toQuery(self, table_name):
+        field = self.field
+        if field != "*" and "." not in field:
+            field = "%s.%s" % (table_name, field)
+        return "{0}({1}{2})".format(self.function, "DISTINCT " if self.distinct else "", field)
+
+
+class Count(Aggregate):
+    function = "COUNT"
+
+    def __init__(self, field="*", distinct=False):
+        super(Count, self).__init__(field, distinct)
+
+
+class Sum(Aggregate):
+    function = "SUM"
+
+
+class Avg(Aggregate):
+    function = "AVG"
+
+
+class Min(Aggregate):
+    function = "MIN"
+
+
+class Max(Aggregate):
+    function = "MAX"
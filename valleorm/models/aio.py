@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+import functools
+import itertools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+atomic_depth = contextvars.ContextVar("valleorm_atomic_depth", default=0)
+
+
+class AsyncExecutor(object):
+    def __init__(self, readers=4):
+        self.readers_size = readers
+        self.writer = None
+        self.readers = None
+        self.locks = weakref.WeakKeyDictionary()
+
+    def configure(self, readers=4):
+        self.shutdown()
+        self.readers_size = readers
+
+    def get_writer(self):
+        if self.writer is None:
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="valleorm-writer")
+        return self.writer
+
+    def get_readers(self):
+        if self.readers is None:
+            self.readers = ThreadPoolExecutor(max_workers=self.readers_size,
+                                              thread_name_prefix="valleorm-reader")
+        return self.readers
+
+    async def read(self, func, *args, **kwargs):
+        if atomic_depth.get():
+            return await self.run_write(func, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.get_readers(),
+                                          functools.partial(context.run, func, *args, **kwargs))
+
+    def write_lock(self):
+        loop = asyncio.get_running_loop()
+        lock = self.locks.get(loop)
+        if lock is None:
+            lock = self.locks[loop] = asyncio.Lock()
+        return lock
+
+    async def run_write(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.get_writer(),
+                                          functools.partial(context.run, func, *args, **kwargs))
+
+    async def write(self, func, *args, **kwargs):
+        if atomic_depth.get():
+            return await self.run_write(func, *args, **kwargs)
+        async with self.write_lock():
+            return await self.run_write(func, *args, **kwargs)
+
+    async def enter_atomic(self, func):
+        depth = atomic_depth.get()
+        if not depth:
+            await self.write_lock().acquire()
+        try:
+            result = await self.run_write(func)
+        except BaseException:
+            if not depth:
+                self.write_lock().release()
+            raise
+        atomic_depth.set(depth + 1)
+        return result
+
+    async def exit_atomic(self, func, *exc):
+        depth = atomic_depth.get()
+        try:
+            return await self.run_write(func, *exc)
+        finally:
+            atomic_depth.set(depth - 1)
+            if depth == 1:
+                self.write_lock().release()
+
+    def shutdown(self, wait=True):
+        if self.writer:
+            self.writer.shutdown(wait=wait)
+        if self.readers:
+            self.readers.shutdown(wait=wait)
+        self.writer = None
+        self.readers = None
+
+
+def fetch_chunk(iterator, size):
+    return list(itertools.islice(iterator, size))
+
+
+def evaluate(result):
+    if hasattr(result, "fetch_all"):
+        return result.fetch_all()
+    return result
+
+
+executor = AsyncExecutor()
@@ -0,0 +1,247 @@
+import re
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .connection import connections
+
+
+class SchemaCache(object):
+    def __init__(self):
+        self.schemas = {}
+        self.lock = threading.Lock()
+
+    def get(self, db_name, tb_name):
+        return self.schemas.get((db_name, tb_name))
+
+    def set(self, db_name, tb_name, schema):
+        with self.lock:
+            self.schemas[(db_name, tb_name)] = schema
+
+    def invalidate(self, db_name=None, tb_name=None):
+        with self.lock:
+            if db_name is None:
+                self.schemas = {}
+            elif tb_name is None:
+                self.schemas = {k: v for k, v in self.schemas.items() if k[0] != db_name}
+            else:
+                self.schemas.pop((db_name, tb_name), None)
+
+
+schema_cache = SchemaCache()
+
+
+class IdentityMap(object):
+    def __init__(self, size=1000):
+        self.size = size
+        self.objects = weakref.WeakValueDictionary()
+        self.recent = OrderedDict()
+
+    def get(self, model, pk):
+        key = (model, pk)
+        obj = self.objects.get(key)
+        if obj is not None:
+            self.touch(key, obj)
+        return obj
+
+    def add(self, obj):
+        key = (obj.__class__, obj.id)
+        self.objects[key] = obj
+        self.touch(key, obj)
+
+    def touch(self, key, obj):
+        self.recent[key] = obj
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.size:
+            self.recent.popitem(last=False)
+
+    def discard(self, model, pk):
+        self.objects.pop((model, pk), None)
+        self.recent.pop((model, pk), None)
+
+    def clear(self, model=None):
+        if model is None:
+            self.objects = weakref.WeakValueDictionary()
+            self.recent = OrderedDict()
+            return
+        for key in [k for k in list(self.objects.keys()) if k[0] is model]:
+            self.discard(*key)
+
+
+current_identity_map = ContextVar("valleorm_identity_map", default=None)
+
+
+@contextmanager
+def session(size=1000):
+    token = current_identity_map.set(IdentityMap(size))
+    try:
+        yield current_identity_map.get()
+    finally:
+        current_identity_map.reset(token)
+
+
+def identity_get(model, pk):
+    imap = current_identity_map.get()
+    if imap is not None:
+        return imap.get(model, pk)
+    return None
+
+
+def identity_add(obj):
+    imap = current_identity_map.get()
+    if imap is not None:
+        imap.add(obj)
+
+
+def identity_discard(model, pk):
+    imap = current_identity_map.get()
+    if imap is not None:
+        imap.discard(model, pk)
+
+
+def identity_clear(model):
+    imap = current_identity_map.get()
+    if imap is not None:
+        imap.clear(model)
+
+
+class LocMemBackend(object):
+    def __init__(self, size=1024):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+
+
+class QueryCache(object):
+    read_tables = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)", re.IGNORECASE)
+    write_tables = re.compile(r"^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM|DROP\s+TABLE|ALTER\s+TABLE)"
+                              r"\s+(?:IF\s+EXISTS\s+)?([A-Za-z_]\w*)", re.IGNORECASE)
+    cascade_sql = re.compile(r"^\s*(?:UPDATE|DELETE)\b", re.IGNORECASE)
+    schema_sql = re.compile(r"^\s*(?:CREATE|ALTER|DROP)\b", re.IGNORECASE)
+
+    def __init__(self, backend=None, ttl=60, enabled=False):
+        self.backend = backend or LocMemBackend()
+        self.ttl = ttl
+        self.enabled = enabled
+        self.references = {}
+        self.local = threading.local()
+
+    def configure(self, backend=None, ttl=60, enabled=False):
+        self.backend = backend or LocMemBackend()
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def tables(self, sql):
+        return sorted(set(self.read_tables.findall(sql)))
+
+    def version(self, db_name, table=None):
+        key = u"v:%s:%s" % (db_name, table) if table else u"v:%s" % db_name
+        version = self.backend.get(key)
+        if version is None:
+            version = self.bump(key)
+        return version
+
+    def bump(self, key):
+        version = uuid.uuid4().hex
+        self.backend.set(key, version, None)
+        return version
+
+    def make_key(self, sql, db_name, params):
+        tables = self.tables(sql)
+        versions = ",".join([self.version(db_name)] + ["%s:%s" % (t, self.version(db_name, t)) for t in tables])
+        return u"%s|%s|%s|%r" % (db_name, versions, " ".join(sql.split()), tuple(params))
+
+    def get_or_set(self, sql, db_name, params, loader, ttl=None):
+        key = self.make_key(sql, db_name, params)
+        value = self.backend.get(key)
+        if value is None:
+            value = loader()
+            self.backend.set(key, value, ttl if ttl is not None else self.ttl)
+        return value
+
+    def pending(self):
+        pending = getattr(self.local, "pending", None)
+        if pending is None:
+            pending = self.local.pending = {}
+        return pending
+
+    def invalidate(self, db_name, tables=None):
+        if tables is None:
+            self.bump(u"v:%s" % db_name)
+        else:
+            for table in tables:
+                self.bump(u"v:%s:%s" % (db_name, table))
+        if connections.in_atomic_block(db_name):
+            self.pending().setdefault(db_name, set()).update(tables or [None])
+
+    def invalidate_sql(self, db_name, sql):
+        if self.schema_sql.match(sql):
+            self.references.pop(db_name, None)
+        match = self.write_tables.match(sql)
+        if match:
+            tables = [match.group(1)]
+            if self.cascade_sql.match(sql):
+                tables.extend(self.referrers(db_name, tables[0]))
+            self.invalidate(db_name, tables)
+
+    def referrers(self, db_name, table):
+        graph = self.references.get(db_name)
+        if graph is None:
+            graph = {}
+            with connections.connection(db_name) as db:
+                names = [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+                for name in names:
+                    for row in db.execute("PRAGMA foreign_key_list(%s);" % name):
+                        graph.setdefault(row[2].lower(), set()).add(name)
+            self.references[db_name] = graph
+        found = set()
+        pending = [table.lower()]
+        while pending:
+            for name in graph.get(pending.pop(), ()):
+                if name not in found:
+                    found.add(name)
+                    pending.append(name.lower())
+        found.discard(table)
+        return sorted(found)
+
+    def flush(self, db_name):
+        tables = self.pending().pop(db_name, None)
+        if tables and not connections.in_atomic_block(db_name):
+            self.invalidate(db_name, None if None in tables else tables)
+
+    def clear(self):
+        self.backend.clear()
+
+
+query_cache = QueryCache()
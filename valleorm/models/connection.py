@@ -0,0 +1,222 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+    "bulk_load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+    "mobile": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+
+
+class ConnectionPool(object):
+    def __init__(self, db_name, size=5, idle_timeout=60, thread_local=False,
+                 cached_statements=256, profile="default", pragmas=None):
+        self.db_name = db_name
+        self.cached_statements = cached_statements
+        self.pragmas = dict(PROFILES[profile])
+        self.pragmas.update(pragmas or {})
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.thread_local = thread_local
+        self.lock = threading.Lock()
+        self.idle = []
+        self.local = threading.local()
+        self.local_conns = []
+
+    def connect(self):
+        timeout = self.pragmas.get("busy_timeout", 5000) / 1000.0
+        db = sqlite3.connect(self.db_name, check_same_thread=False, timeout=timeout,
+                             cached_statements=self.cached_statements,
+                             uri=self.db_name.startswith("file:"))
+        for k, v in self.pragmas.items():
+            db.execute("PRAGMA %s=%s;" % (k, v))
+        return db
+
+    def acquire(self):
+        if self.thread_local:
+            db = getattr(self.local, "db", None)
+            if db is None:
+                db = self.connect()
+                self.local.db = db
+                with self.lock:
+                    self.evict_dead_threads()
+                    self.local_conns.append((threading.current_thread(), db))
+            return db
+
+        with self.lock:
+            self.evict_idle()
+            if self.idle:
+                db, last_used = self.idle.pop()
+                return db
+        return self.connect()
+
+    def release(self, db):
+        if self.thread_local:
+            return
+        if db.in_transaction:
+            db.rollback()
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((db, time.time()))
+                return
+        db.close()
+
+    def evict_idle(self):
+        if self.idle_timeout is None:
+            return
+        limit = time.time() - self.idle_timeout
+        alive = []
+        for db, last_used in self.idle:
+            if last_used < limit:
+                db.close()
+            else:
+                alive.append((db, last_used))
+        self.idle = alive
+
+    def evict_dead_threads(self):
+        alive = []
+        for thread, db in self.local_conns:
+            if thread.is_alive():
+                alive.append((thread, db))
+            else:
+                db.close()
+        self.local_conns = alive
+
+    def close_all(self):
+        with self.lock:
+            for db, last_used in self.idle:
+                db.close()
+            for thread, db in self.local_conns:
+                db.close()
+            self.idle = []
+            self.local_conns = []
+            self.local = threading.local()
+
+
+class ConnectionManager(object):
+    def __init__(self):
+        self.pools = {}
+        self.options = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def configure(self, db_name, **options):
+        with self.lock:
+            self.options[db_name] = options
+            pool = self.pools.pop(db_name, None)
+        if pool:
+            pool.close_all()
+
+    def get_pool(self, db_name):
+        pool = self.pools.get(db_name)
+        if pool is None:
+            with self.lock:
+                pool = self.pools.get(db_name)
+                if pool is None:
+                    pool = ConnectionPool(db_name, **self.options.get(db_name, {}))
+                    self.pools[db_name] = pool
+        return pool
+
+    def atomic_blocks(self):
+        blocks = getattr(self.local, "blocks", None)
+        if blocks is None:
+            blocks = self.local.blocks = {}
+        return blocks
+
+    def in_atomic_block(self, db_name):
+        return db_name in self.atomic_blocks()
+
+    @contextmanager
+    def connection(self, db_name):
+        bound = self.atomic_blocks().get(db_name)
+        if bound:
+            yield bound[0]
+            return
+
+        pool = self.get_pool(db_name)
+        db = pool.acquire()
+        try:
+            yield db
+        except BaseException:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        else:
+            if db.in_transaction:
+                db.commit()
+        finally:
+            pool.release(db)
+
+    @contextmanager
+    def atomic(self, db_name):
+        blocks = self.atomic_blocks()
+        if db_name in blocks:
+            db, depth = blocks[db_name]
+            savepoint = "valleorm_sp_%d" % depth
+            db.execute("SAVEPOINT %s;" % savepoint)
+            blocks[db_name] = (db, depth + 1)
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK TO %s;" % savepoint)
+                db.execute("RELEASE %s;" % savepoint)
+                raise
+            else:
+                db.execute("RELEASE %s;" % savepoint)
+            finally:
+                blocks[db_name] = (db, depth)
+            return
+
+        pool = self.get_pool(db_name)
+        db = pool.acquire()
+        if db.in_transaction:
+            db.commit()
+        db.execute("BEGIN;")
+        blocks[db_name] = (db, 1)
+        try:
+            yield db
+        except BaseException:
+            db.rollback()
+            raise
+        else:
+            db.commit()
+        finally:
+            del blocks[db_name]
+            pool.release(db)
+
+    def close_all(self, db_name=None):
+        with self.lock:
+            if db_name:
+                pools = [self.pools.pop(db_name)] if db_name in self.pools else []
+            else:
+                pools = list(self.pools.values())
+                self.pools = {}
+        for pool in pools:
+            pool.close_all()
+
+
+connections = ConnectionManager()
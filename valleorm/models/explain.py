@@ -0,0 +1,175 @@
+import re
+import threading
+from .connection import connections
+from .indexes import Index
+from .instrumentation import instrumentation
+
+
+class QueryPlan(object):
+    step_re = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)(?:\s+AS\s+(\w+))?"
+                         r"(?:\s+USING\s+(?:(COVERING INDEX|INDEX|INTEGER PRIMARY KEY|AUTOMATIC\s+[\w ]*?INDEX)"
+                         r"(?:\s+(\w+))?)?)?(?:\s+\((.*)\))?")
+    constraint_re = re.compile(r"(\w+)\s*(?:=|>|<|IN\b)")
+    alias_re = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)(?:\s+AS\s+([A-Za-z_]\w*))?", re.IGNORECASE)
+
+    def __init__(self, sql, params, rows):
+        self.sql = sql
+        self.params = params
+        aliases = {}
+        for table, alias in self.alias_re.findall(sql):
+            aliases[alias or table] = table
+        self.steps = []
+        self.root = []
+        nodes = {}
+        for row in rows:
+            step = self.parse_step(row[0], row[1], row[3], aliases)
+            nodes[step["id"]] = step
+            parent = nodes.get(step["parent"])
+            if parent is None:
+                self.root.append(step)
+            else:
+                parent["children"].append(step)
+            self.steps.append(step)
+
+    def parse_step(self, id, parent, detail, aliases):
+        step = {"id": id, "parent": parent, "detail": detail, "operation": None, "table": None,
+                "alias": None, "index": None, "constraints": [], "children": []}
+        match = self.step_re.match(detail)
+        if match:
+            operation, name, alias, using, index, constraints = match.groups()
+            step["operation"] = operation
+            step["alias"] = alias or name
+            step["table"] = aliases.get(name, name)
+            if using == "INTEGER PRIMARY KEY":
+                step["index"] = "PRIMARY KEY"
+            elif using:
+                step["index"] = index or using
+            if constraints:
+                step["constraints"] = self.constraint_re.findall(constraints)
+        else:
+            step["operation"] = detail.split(" (")[0]
+        return step
+
+    @property
+    def scans(self):
+        return [s for s in self.steps if s["operation"] == "SCAN" and s["index"] is None]
+
+    @property
+    def uses_temp_btree(self):
+        return any(s["detail"].startswith("USE TEMP B-TREE") for s in self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __str__(self):
+        lines = []
+
+        def write(steps, depth):
+            for step in steps:
+                lines.append("%s%s" % ("  " * depth, step["detail"]))
+                write(step["children"], depth + 1)
+
+        write(self.root, 0)
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "<QueryPlan %s>" % "; ".join(s["detail"] for s in self.steps)
+
+
+def explain_query(sql, db_name, params=()):
+    with connections.connection(db_name) as db:
+        rows = db.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return QueryPlan(sql, params, rows)
+
+
+class IndexAdvisor(object):
+    column_re = re.compile(r"(?<![\w.'])(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\s*(?:=|>=|<=|<>|!=|>|<|\bIN\b|\bBETWEEN\b)",
+                           re.IGNORECASE)
+
+    def __init__(self, min_rows=1000):
+        self.min_rows = min_rows
+        self.records = {}
+        self.columns = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.enabled = False
+
+    def enable(self, min_rows=None):
+        if min_rows is not None:
+            self.min_rows = min_rows
+        if not self.enabled:
+            instrumentation.connect(after=self)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            instrumentation.disconnect(after=self)
+            self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.records = {}
+            self.columns = {}
+
+    def __call__(self, event):
+        if event.error is not None or event.kind != "SELECT" or getattr(self.local, "busy", False):
+            return
+        self.local.busy = True
+        try:
+            self.inspect(event.sql, event.db_name, event.params)
+        finally:
+            self.local.busy = False
+
+    def inspect(self, sql, db_name, params=()):
+        plan = explain_query(sql, db_name, params)
+        for step in plan.scans:
+            table = step["table"]
+            rows = self.table_size(db_name, table)
+            if rows < self.min_rows:
+                continue
+            columns = self.lookup_columns(sql, db_name, table, step["alias"])
+            if not columns:
+                continue
+            key = (db_name, table, columns)
+            with self.lock:
+                record = self.records.get(key)
+                if record is None:
+                    record = self.records[key] = {"db_name": db_name, "table": table, "columns": list(columns),
+                                                  "rows": rows, "count": 0, "sql": sql,
+                                                  "suggestion": Index(list(columns)).toQuery(table)}
+                record["count"] += 1
+                record["rows"] = rows
+        return plan
+
+    def table_size(self, db_name, table):
+        with connections.connection(db_name) as db:
+            return db.execute("SELECT COALESCE(MAX(rowid), 0) FROM %s;" % table).fetchone()[0]
+
+    def table_columns(self, db_name, table):
+        columns = self.columns.get((db_name, table))
+        if columns is None:
+            with connections.connection(db_name) as db:
+                columns = set(r[1] for r in db.execute("PRAGMA table_info(%s);" % table).fetchall())
+            self.columns[(db_name, table)] = columns
+        return columns
+
+    def lookup_columns(self, sql, db_name, table, alias):
+        known = self.table_columns(db_name, table)
+        found = []
+        for prefix, column in self.column_re.findall(sql):
+            if prefix and prefix not in (table, alias):
+                continue
+            if column in ("id", "rowid") or column not in known or column in found:
+                continue
+            found.append(column)
+        return tuple(found)
+
+    def report(self):
+        with self.lock:
+            return sorted([dict(r) for r in self.records.values()], key=lambda r: -r["count"])
+
+    def suggestions(self):
+        return [r["suggestion"] for r in self.report()]
+
+
+index_advisor = IndexAdvisor()
@@ -22,6 +22,8 @@ class __Field__(object):
         self.tipo_class = constant.TIPO_CAMPO
         self.default = None
         self.null = False
+        self.db_index = False
+        self.unique = False
         self.tipo = 'TEXT'
         for k, v in options.items():
             setattr(self, k, v)
@@ -34,12 +36,25 @@ class __Field__(object):
             return str(self.get_dato())
 
     def get_dato(self):
-        if self.null == False and self.dato == None:
-            raise ValueError("Error el valor no puede ser nulo")
+        self.dato = self.check_dato(self.dato)
         return self.dato
 
+    def check_dato(self, value):
+        if self.null == False and value == None:
+            raise ValueError("Error el valor no puede ser nulo")
+        return value
+
+    def get_db_dato(self):
+        return self.db_dato(self.get_dato())
+
+    def db_dato(self, value):
+        return value
+
     def set_dato(self, value):
-        self.dato = value
+        self.dato = self.parse_dato(value)
+
+    def parse_dato(self, value):
+        return value
 
    
     def serialize_field(self, field_name):
@@ -53,7 +68,10 @@ class __Field__(object):
         return u"{2} {0} {1}".format(strnull, strdefault, self.tipo)
 
     def get_str_value(self):
-        return str(self.get_dato())
+        return self.str_dato(self.get_dato())
+
+    def str_dato(self, value):
+        return str(value)
 
 
 
@@ -78,10 +96,10 @@ class EmailField(CharField):
         super(EmailField, self).__init__(max_length, **options)
         self.class_name = 'EmailField'
 
-    def set_dato(self, value):
+    def parse_dato(self, value):
         if not ("@" in value and "." in value):
             raise ValueError('Formato email no valido')
-        self.dato = value
+        return value
 
 
 class DecimalField(__Field__):
@@ -92,13 +110,14 @@ class DecimalField(__Field__):
         self.class_name = "DecimalField"
         self.tipo = "NUMERIC"
 
-    def set_dato(self, value):
+    def parse_dato(self, value):
         if value != None and type(value) == str and value.strip() != "":
-            self.dato = float(value.replace(",", "."))
-        else:
-            self.dato = value
+            value = float(value.replace(",", "."))
         format = "%0.{0}f".format(self.decimal_places)
-        self.dato = Decimal(format % self.dato)
+        return Decimal(format % value)
+
+    def db_dato(self, value):
+        return str(value) if value != None else None
         
     def toQuery(self):
         strnull = 'NOT NULL' if not self.null else 'NULL'
@@ -114,29 +133,31 @@ class DateField(__Field__):
         self.auto_now=auto_now
         self.auto_now_add=auto_now_add
 
-    def set_dato(self, value):
+    def parse_dato(self, value):
         if type(value) is str:
-            self.dato = datetime.strptime(value, '%m/%d/%y')
-        else:
-            self.dato = value
+            return datetime.strptime(value, '%m/%d/%y')
+        return value
 
 
-    def get_dato(self):
+    def check_dato(self, value):
         if self.auto_now:
-            self.dato = datetime.now()
-        elif self.auto_now_add and self.dato == None:
-            self.dato = datetime.now()
-        elif self.null == False and self.dato == None:
+            return datetime.now()
+        elif self.auto_now_add and value == None:
+            return datetime.now()
+        elif self.null == False and value == None:
             raise ValueError("El dato no puede ser null")
 
-        return self.dato
+        return value
 
 
     def get_pack_dato(self):
         return u'"{0}"'.format(self.get_dato().strftime('%m/%d/%y'))
 
-    def get_str_value(self):
-        return self.get_dato().strftime('%m/%d/%y')
+    def db_dato(self, value):
+        return value.strftime('%m/%d/%y') if value != None else None
+
+    def str_dato(self, value):
+        return value.strftime('%m/%d/%y')
 
 
 
@@ -148,29 +169,31 @@ class DateTimeField(__Field__):
         self.auto_now=auto_now
         self.auto_now_add=auto_now_add
 
-    def set_dato(self, value):
+    def parse_dato(self, value):
         if type(value) is str:
-            self.dato = datetime.strptime(value, '%m/%d/%y %H:%M:%S')
-        else:
-            self.dato = value
+            return datetime.strptime(value, '%m/%d/%y %H:%M:%S')
+        return value
         
 
-    def get_dato(self):
+    def check_dato(self, value):
         if self.auto_now:
-            self.dato = datetime.now()
-        elif self.auto_now_add and self.dato == None:
-            self.dato = datetime.now()
-        elif self.null == False and self.dato == None:
+            return datetime.now()
+        elif self.auto_now_add and value == None:
+            return datetime.now()
+        elif self.null == False and value == None:
             raise ValueError("El dato no puede ser null")
 
-        return self.dato
+        return value
 
 
     def get_pack_dato(self):
         return u'"{0}"'.format(self.get_dato().strftime('%m/%d/%y %H:%M:%S'))
 
-    def get_str_value(self):
-        return self.get_dato().strftime('%m/%d/%y %H:%M:%S')
+    def db_dato(self, value):
+        return value.strftime('%m/%d/%y %H:%M:%S') if value != None else None
+
+    def str_dato(self, value):
+        return value.strftime('%m/%d/%y %H:%M:%S')
 
 
 class BooleanField(__Field__):
@@ -179,15 +202,17 @@ class BooleanField(__Field__):
         self.tipo="BOOL"
         self.class_name = "BooleanField"
 
-    def set_dato(self, value):
+    def parse_dato(self, value):
         if value:
-            self.dato = True
-        else:
-            self.dato = False
+            return True
+        return False
 
     def get_pack_dato(self):
         return "1" if self.get_dato() else "0"
 
+    def db_dato(self, value):
+        return 1 if value else 0
+
 class IntegerField(__Field__):
     def __init__(self, **options):
         super(IntegerField, self).__init__(**options)
@@ -216,14 +241,46 @@ class UUIDField(__Field__):
         self.class_name = "UUIDField"
         self.tipo="TEXT"
 
-    def get_dato(self):
-        return str(uuid.uuid4())
+    def check_dato(self, value):
+        return value if value else str(uuid.uuid4())
 
 
     def toQuery(self):
         return "TEXT UNIQUE NOT NULL"
 
 
+class DeferredField(object):
+    def __repr__(self):
+        return "<DeferredField>"
+
+
+DEFERRED = DeferredField()
+
+
+class FieldDescriptor(object):
+    def __init__(self, name, field=None):
+        self.name = name
+        self.field = field
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self.field if self.field is not None else self
+        compiled = obj.compiled
+        if self.name in compiled.index:
+            return compiled.get_value(obj, self.name)
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, obj, value):
+        compiled = obj.compiled
+        if self.name in compiled.index:
+            compiled.set_value(obj, self.name, value)
+        else:
+            obj.__dict__[self.name] = value
+
+
 def create_field_class(config):
     modulo = importlib.import_module('valleorm.models.fields')
     class_name = config.get("class_name")
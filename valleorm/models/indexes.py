@@ -0,0 +1,36 @@
+from .tools import Utility, Q
+
+
+class Index(object):
+    def __init__(self, fields, name=None, unique=False, condition=None):
+        self.fields = list(fields)
+        self.name = name
+        self.unique = unique
+        self.condition = condition
+
+    def get_name(self, table_name):
+        if self.name:
+            return self.name
+        prefix = "uniq" if self.unique else "idx"
+        return "{0}_{1}_{2}".format(prefix, table_name, "_".join(self.fields))
+
+    def get_condition(self):
+        condition = self.condition
+        if type(condition) == dict:
+            condition = Q(**condition)
+        if isinstance(condition, Q):
+            parts = str(condition).split("?")
+            sql = parts[0]
+            for value, part in zip(condition.params, parts[1:]):
+                sql += Utility.quote_value(value) + part
+            return sql
+        return condition
+
+    def toQuery(self, table_name):
+        sql = u"CREATE {0}INDEX IF NOT EXISTS {1} ON {2} ({3})".format("UNIQUE " if self.unique else "",
+                                                                    self.get_name(table_name), table_name,
+                                                                    ", ".join(self.fields))
+        condition = self.get_condition()
+        if condition:
+            sql += " WHERE %s" % condition
+        return sql + ";"
@@ -0,0 +1,158 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from .cache import QueryCache
+
+
+class QueryEvent(object):
+    def __init__(self, instrumentation, sql, db_name, params=()):
+        self.instrumentation = instrumentation
+        self.sql = sql
+        self.db_name = db_name
+        self.params = params
+        self.start = None
+        self.running = None
+        self.duration = 0.0
+        self.rows = None
+        self.error = None
+
+    @property
+    def kind(self):
+        return self.sql.lstrip().split(None, 1)[0].upper() if self.sql.strip() else ""
+
+    @property
+    def table(self):
+        match = QueryCache.write_tables.match(self.sql) or QueryCache.read_tables.search(self.sql)
+        return match.group(1) if match else None
+
+    @property
+    def model(self):
+        from .tools import Utility
+        table = self.table
+        for model in list(Utility.models.values()):
+            if Utility.default_tb_name(model) == table and Utility.default_db_name(model) == self.db_name:
+                return model
+        return None
+
+    def __enter__(self):
+        for hook in self.instrumentation.before:
+            hook(self)
+        self.start = self.running = time.perf_counter()
+        return self
+
+    def suspend(self):
+        if self.running is not None:
+            self.duration += time.perf_counter() - self.running
+            self.running = None
+
+    def resume(self):
+        if self.running is None:
+            self.running = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.suspend()
+        self.error = exc if exc_type is not GeneratorExit else None
+        for hook in self.instrumentation.after:
+            hook(self)
+
+
+class NullEvent(object):
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def suspend(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+class Instrumentation(object):
+    def __init__(self):
+        self.before = ()
+        self.after = ()
+        self.active = False
+        self.lock = threading.Lock()
+        self.null_event = NullEvent()
+
+    def connect(self, before=None, after=None):
+        with self.lock:
+            if before is not None:
+                self.before = self.before + (before,)
+            if after is not None:
+                self.after = self.after + (after,)
+            self.active = bool(self.before or self.after)
+
+    def disconnect(self, before=None, after=None):
+        with self.lock:
+            if before is not None:
+                self.before = tuple(h for h in self.before if h is not before)
+            if after is not None:
+                self.after = tuple(h for h in self.after if h is not after)
+            self.active = bool(self.before or self.after)
+
+    def query(self, sql, db_name, params=()):
+        if not self.active:
+            return self.null_event
+        return QueryEvent(self, sql, db_name, params)
+
+
+instrumentation = Instrumentation()
+
+
+class SlowQueryLogger(object):
+    def __init__(self, threshold=0.1, logger=None):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger("valleorm.slow_queries")
+
+    def __call__(self, event):
+        if event.duration >= self.threshold:
+            self.logger.warning("%.1f ms %s %s %r", event.duration * 1000, event.db_name,
+                                event.sql, event.params)
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def __call__(self, event):
+        table = event.table or ""
+        with self.lock:
+            stats = self.tables.get(table)
+            if stats is None:
+                stats = self.tables[table] = {"queries": 0, "rows": 0, "time": 0.0, "errors": 0}
+            stats["queries"] += 1
+            stats[event.kind] = stats.get(event.kind, 0) + 1
+            stats["rows"] += event.rows if event.rows and event.rows > 0 else 0
+            stats["time"] += event.duration
+            if event.error is not None:
+                stats["errors"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.tables = {}
+
+
+@contextmanager
+def assert_num_queries(num, db_name=None):
+    events = []
+
+    def record(event):
+        if db_name is None or event.db_name == db_name:
+            events.append(event)
+
+    instrumentation.connect(after=record)
+    try:
+        yield events
+    finally:
+        instrumentation.disconnect(after=record)
+    if len(events) != num:
+        raise AssertionError("Se esperaban %d consultas y se ejecutaron %d:\n%s" % (
+            num, len(events), "\n".join(["  %s" % e.sql for e in events])))
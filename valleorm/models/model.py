@@ -7,63 +7,220 @@
 # @Last modified time: 05-Sep-2017
 # @License: Apache license vesion 2.0
 
-import sqlite3
 import json
 import base64
+import inspect
 
 
 from . import constant
+from . import relatedfields
 from .fields import *
 from .relatedfields import *
 from .tools import Utility
+from .queryset import QuerySet
+from .indexes import Index
+from .cache import schema_cache, identity_get, identity_add, identity_discard, identity_clear
+from .aio import executor
+from .connection import connections
+from .router import router
 
 
 
-class Model(object):
+class CompiledSchema(object):
 
-    def __init__(self, schema=None, **options):
+    def __init__(self, schema, model):
+        self.schema = schema
+        self.table_name = Utility.default_tb_name(model)
+        self.db_name = Utility.default_db_name(model)
+        self.lstCampos = []
+        self.fields = []
+        self.meta = {}
+        self.relations = []
+        self.protos = {}
+        self.index = {}
+        self.defaults = []
+        self.factories = {}
+        for m in schema.get("fields", []):
+            field = create_field_class(m)
+            self.index[m["field_name"]] = len(self.defaults)
+            self.lstCampos.append(m["field_name"])
+            self.fields.append((m["field_name"], field))
+            self.meta[m["field_name"]] = field
+            self.defaults.append(field.dato)
+        for m in schema.get("relationship", []):
+            relation = getattr(relatedfields, m["class_name"])(**m)
+            self.index[m["field_name"]] = len(self.defaults)
+            self.relations.append((m["field_name"], relation.__class__, relation.__dict__))
+            self.protos[m["field_name"]] = (relation.__class__, relation.__dict__)
+            self.defaults.append(None)
+
+    def get_value(self, obj, name):
+        i = self.index[name]
+        values = obj.__values__
+        value = values[i]
+        field = self.meta.get(name)
+        if field is None:
+            return value if value is not None else self.relation(obj, name)
+        if value is DEFERRED:
+            obj.__load_deferred__()
+            value = values[i]
+        dato = field.check_dato(value)
+        if dato is not value:
+            values[i] = dato
+        return dato
+
+    def set_value(self, obj, name, value):
+        i = self.index[name]
+        values = obj.__values__
+        field = self.meta.get(name)
+        if field is None:
+            values[i] = value
+            return
+        if obj.estado == constant.STATE_LOAD:
+            obj.__track__(name, values[i])
+        values[i] = field.parse_dato(value)
+
+    def db_value(self, obj, name):
+        return self.meta[name].db_dato(self.get_value(obj, name))
+
+    def relation(self, obj, name):
+        klass, proto = self.protos[name]
+        relation = object.__new__(klass)
+        relation.__dict__ = proto.copy()
+        relation.parent = obj
+        obj.__values__[self.index[name]] = relation
+        return relation
+
+    def row_factory(self, model, d):
+        columns = tuple(c[0] for c in d)
+        build = self.factories.get(columns)
+        if build is None:
+            build = self.factories[columns] = self.compile_row(model, columns)
+        return build
+
+    def compile_row(self, model, columns):
+        id_index = columns.index("id") if "id" in columns else None
+        loaders = [(i, self.index[c], self.meta[c].parse_dato) for i, c in enumerate(columns) if c in self.meta]
+        extras = [(i, c) for i, c in enumerate(columns) if c != "id" and c not in self.meta]
+        deferred = [self.index[c] for c in self.lstCampos if c not in columns]
+        defaults = self.defaults
+        new = object.__new__
+        compiled = self
+
+        def build(r):
+            obj = new(model)
+            values = list(defaults)
+            for i, pos, parse in loaders:
+                v = r[i]
+                values[pos] = parse(v) if v is not None else None
+            for pos in deferred:
+                values[pos] = DEFERRED
+            obj.compiled = compiled
+            obj.estado = constant.STATE_LOAD
+            obj.id = r[id_index] if id_index is not None else -1
+            obj.__values__ = values
+            obj.__original__ = None
+            for i, name in extras:
+                setattr(obj, name, r[i])
+            return obj
+
+        return build
+
+
+class ModelBase(type):
+    def __new__(mcs, name, bases, attrs):
+        attrs.setdefault("__slots__", ())
+        for key, value in list(attrs.items()):
+            tipo_class = getattr(value, "tipo_class", "")
+            if tipo_class in (constant.TIPO_CAMPO, constant.TIPO_RELATION):
+                attrs[key] = FieldDescriptor(key, value)
+            if tipo_class == constant.TIPO_RELATION and getattr(value, "class_name", "") == "ForeignKey":
+                attrs.setdefault(key + "_id", FieldDescriptor(key + "_id"))
+        return super(ModelBase, mcs).__new__(mcs, name, bases, attrs)
+
+    def install_descriptors(cls, compiled):
+        for name in compiled.index:
+            if inspect.getattr_static(cls, name, None) is None:
+                setattr(cls, name, FieldDescriptor(name))
+
+
+class Model(object, metaclass=ModelBase):
+    __slots__ = ("compiled", "estado", "id", "__values__", "__original__", "__dict__", "__weakref__")
+
+    def __init_subclass__(cls, **kwargs):
+        super(Model, cls).__init_subclass__(**kwargs)
+        Utility.models[cls.__name__] = cls
+        router.claim(cls)
 
+    def __init__(self, schema=None, **options):
+        cls = type(self)
+        if not schema:
+            schema = cls.get_schema()
+        compiled = cls.compile_schema(schema)
+        self.compiled = compiled
         self.estado = constant.STATE_NEW
-        self.lstCampos = []
-        self.table_name = Utility.default_tb_name(self.__class__)
-        self.dbName = Utility.default_db_name(self.__class__)
-        self.schema= schema
         self.id = -1
-        if not schema:
-            self.schema = self.__class__.get_schema()
-        self.__complete_schema__()       
+        self.__values__ = list(compiled.defaults)
+        self.__original__ = None
         for k, v in options.items():
             setattr(self, k, v)
 
-    def __setattr__(self, attr, value):
-        
-        if hasattr(self, 'lstCampos') and self.lstCampos and attr in self.lstCampos:
-            field = super(Model, self).__getattribute__(attr)
-            field.set_dato(value)
-        else:
-            super(Model, self).__setattr__(attr, value)
-
-    def __getattribute__(self, attr):
-        value = super(Model, self).__getattribute__(attr)
-        if hasattr(value, 'get_dato'):
-            return value.get_dato()
-        
-        return value
-       
-
-    #Introspection of  the models
-    def __complete_schema__(self):
-        self.lstCampos = []
-        if "fields" in self.schema:
-            for m in self.schema.get("fields"):
-                field_name = m["field_name"]
-                setattr(self, field_name, eval(m["class_name"])(**m))
-                self.lstCampos.append(field_name)
-        if "relationship" in self.schema:  
-            for m in self.schema.get("relationship"):
-                field_name = m.get("field_name")
-                m["parent"] = self
-                setattr(self, field_name, eval(m["class_name"])(**m))
+    @property
+    def schema(self):
+        return self.compiled.schema
+
+    @property
+    def table_name(self):
+        return self.compiled.table_name
+
+    @property
+    def dbName(self):
+        return self.compiled.db_name
+
+    @property
+    def lstCampos(self):
+        return self.compiled.lstCampos
+
+    def __track__(self, attr, old):
+        original = self.__original__
+        if original is None:
+            original = self.__original__ = {}
+        if attr not in original:
+            original[attr] = old
+
+    def get_dirty_fields(self):
+        dirty = []
+        original = self.__original__ or {}
+        values = self.__values__
+        index = self.compiled.index
+        for key, field in self.compiled.fields:
+            if getattr(field, "auto_now", False):
+                dirty.append(key)
+            elif key in original:
+                old = original[key]
+                if old is DEFERRED or old != values[index[key]]:
+                    dirty.append(key)
+        return dirty
+
+    def __mark_loaded__(self, fields=None):
+        self.estado = constant.STATE_LOAD
+        original = self.__original__
+        if original and fields:
+            for key in fields:
+                original.pop(key, None)
+        elif original:
+            self.__original__ = None
+
+    def __load_deferred__(self):
+        compiled = self.compiled
+        values = self.__values__
+        names = [k for k in compiled.lstCampos if values[compiled.index[k]] is DEFERRED]
+        if not names:
+            return
+        sql = u"SELECT {0} FROM {1} WHERE id=?;".format(", ".join(names), self.table_name)
+        reg, d = Utility.select(sql, self.dbName, (self.id,), cache=False)
+        for name, v in zip(names, reg[0] if reg else [None] * len(names)):
+            values[compiled.index[name]] = compiled.meta[name].parse_dato(v) if v is not None else None
 
     def __cargar_datos__(self, **datos):
         for k, v in datos.items():
@@ -71,7 +228,6 @@ class Model(object):
                 self.id = v
             else:
                 setattr(self, k, v)
-                self.lstCampos.append(k)
 
 
 
@@ -79,45 +235,50 @@ class Model(object):
         self.__cargar_datos__(**kargs)
         self.id = -1 if self.id == None else self.id
 
-        if self.estado == constant.STATE_NEW:
-            keys =[]
-            vals = []
-            for key in self.lstCampos:
-                val = super(Model, self).__getattribute__(key)
-                pack_data = val.get_pack_dato()
-                if "None" not in pack_data:  
-                    keys.append(key)
-                    vals.append(pack_data)
-            cols = ", ".join(keys)
-            values = ", ".join(vals)
-            sql = u"INSERT INTO {0} ({1}) VALUES ({2});".format(self.table_name,
-                                                                   cols, values)
+        if self.estado != constant.STATE_LOAD or self.id == -1:
+            keys, params = self.__insert_params__()
+            sql = self.__class__.sql_insert(keys)
+            self.id = Utility.execute_insert(sql, self.dbName, params)
         else:
-            vals = []
-            for key in self.lstCampos:
-                val = super(Model, self).__getattribute__(key)
-                pack_data = val.get_pack_dato()
-                if "None" not in pack_data:
-                    vals.append(u"{0} = {1}".format(key, pack_data))
-            values = ", ".join(vals)
-            sql = u"UPDATE {0}  SET {1} WHERE id={2};".format(self.table_name,
-                                                              values, self.id);
-        db = sqlite3.connect(self.dbName)
-        cursor = db.cursor()
-        cursor.execute(sql)
-        if self.id == -1:
-            self.id = cursor.lastrowid
-        db.commit()
-        db.close()
+            keys = tuple(self.get_dirty_fields())
+            if not keys:
+                return
+            params = [self.compiled.db_value(self, key) for key in keys]
+            params.append(self.id)
+            Utility.execute_query(self.__class__.sql_update(keys), self.dbName, params)
+        self.__mark_loaded__()
+        if identity_get(self.__class__, self.id) is not self:
+            identity_discard(self.__class__, self.id)
+
+    def __insert_params__(self):
+        keys = []
+        params = []
+        compiled = self.compiled
+        values = self.__values__
+        for key, field in compiled.fields:
+            if values[compiled.index[key]] is DEFERRED:
+                continue
+            val = compiled.db_value(self, key)
+            if val != None and key not in keys:
+                keys.append(key)
+                params.append(val)
+        return tuple(keys), params
 
     def delete(self):
         self.id = -1 if self.id == None else self.id
-        sql = u"DELETE FROM {0} WHERE id={1};".format(self.table_name, self.id)
-        Utility.execute_query(sql, self.dbName)
+        sql = u"DELETE FROM {0} WHERE id=?;".format(self.table_name)
+        Utility.execute_query(sql, self.dbName, (self.id,))
+        identity_discard(self.__class__, self.id)
         self.id = -1
         self.estado = constant.STATE_DELETE
         return "success"
 
+    async def asave(self, **kargs):
+        return await executor.write(self.save, **kargs)
+
+    async def adelete(self):
+        return await executor.write(self.delete)
+
     def toJSON(self):
         js = self.toDICT()
         return json.dumps(js, ensure_ascii=False)
@@ -127,74 +288,169 @@ class Model(object):
             js = {"id": self.id}
         else:
             js = {}
-        for key in self.lstCampos:
-            field = super().__getattribute__(key)
-            if field.dato:
-                js[key] = field.get_str_value()
+        compiled = self.compiled
+        values = self.__values__
+        for key, field in compiled.fields:
+            i = compiled.index[key]
+            if values[i] is DEFERRED:
+                self.__load_deferred__()
+            if values[i]:
+                js[key] = field.str_dato(compiled.get_value(self, key))
         return js
     
     
+    @classmethod
+    def compile_schema(cls, schema):
+        compiled = cls.__dict__.get("__compiled__")
+        if compiled is None or compiled.schema is not schema:
+            compiled = CompiledSchema(schema, cls)
+            cls.install_descriptors(compiled)
+            cls.__compiled__ = compiled
+        return compiled
+
+    @classmethod
+    def row_factory(cls, d):
+        return cls.compile_schema(cls.get_schema()).row_factory(cls, d)
+
+    @classmethod
+    def load_row(cls, d, r):
+        return cls.row_factory(d)(r)
+
     @classmethod
     def filter(cls, *args, **kwargs):
-        sql = "SELECT * FROM {0} {1};".format(Utility.default_tb_name(cls), Utility.decode_condition(cls, *args, **kwargs))
-        reg, d = Utility.execute_select(sql, Utility.default_db_name(cls))
-        registros = []
-        for r in reg:
-            res = dict({k[0]: v for k, v in list(zip(d, r))})
-            obj = cls()
-            obj.__cargar_datos__(**res)
-            registros.append(obj)
-
-        return registros
-               
+        return QuerySet(cls).filter(*args, **kwargs)
+
+    @classmethod
+    def sql_insert(cls, keys):
+        tb_name = Utility.default_tb_name(cls)
+        return Utility.cached_sql((tb_name, "insert", keys),
+                                  lambda: u"INSERT INTO {0} ({1}) VALUES ({2});".format(tb_name,
+                                          ", ".join(keys), ", ".join(["?"] * len(keys))))
+
+    @classmethod
+    def sql_update(cls, keys):
+        tb_name = Utility.default_tb_name(cls)
+        return Utility.cached_sql((tb_name, "update", keys),
+                                  lambda: u"UPDATE {0} SET {1} WHERE id=?;".format(tb_name,
+                                          ", ".join([u"{0} = ?".format(key) for key in keys])))
+
+    @classmethod
+    def bulk_create(cls, objs, batch_size=500):
+        groups = {}
+        for obj in objs:
+            keys, params = obj.__insert_params__()
+            groups.setdefault(keys, []).append((obj, params))
+
+        batches = []
+        owners = []
+        for keys, items in groups.items():
+            sql = cls.sql_insert(keys)
+            for i in range(0, len(items), batch_size):
+                chunk = items[i:i+batch_size]
+                batches.append((sql, [params for obj, params in chunk]))
+                owners.extend([obj for obj, params in chunk])
+
+        ids = Utility.execute_many_insert(batches, Utility.default_db_name(cls))
+        for obj, pk in zip(owners, ids):
+            obj.id = pk
+            obj.__mark_loaded__()
+        return objs
+
+    @classmethod
+    def bulk_update(cls, objs, fields, batch_size=500):
+        keys = tuple(fields)
+        sql = cls.sql_update(keys)
+        batches = []
+        rows = []
+        objs = list(objs)
+        for obj in objs:
+            row = [obj.compiled.db_value(obj, key) for key in keys]
+            row.append(obj.id)
+            rows.append(row)
+            if len(rows) >= batch_size:
+                batches.append((sql, rows))
+                rows = []
+        if rows:
+            batches.append((sql, rows))
+        identity_clear(cls)
+        rowcount = Utility.execute_many(batches, Utility.default_db_name(cls))
+        for obj in objs:
+            obj.__mark_loaded__(keys)
+        return rowcount
+
+    @classmethod
+    async def abulk_create(cls, objs, batch_size=500):
+        return await executor.write(cls.bulk_create, objs, batch_size)
+
+    @classmethod
+    async def abulk_update(cls, objs, fields, batch_size=500):
+        return await executor.write(cls.bulk_update, objs, fields, batch_size)
 
-    
     @classmethod
     def empty(cls):
-        Utility.execute_query("DELETE FROM %s;" % Utility.default_tb_name(cls))
+        identity_clear(cls)
+        Utility.execute_query("DELETE FROM %s;" % Utility.default_tb_name(cls),
+                              Utility.default_db_name(cls))
 
 
     @classmethod
     def first(cls, *args, **kwargs):
-        condition["limit"] = 1
-        reg = cls.filter(**kwargs)
-        if len(reg) > 0:
-            return  reg[0]
+        return cls.filter(*args, **kwargs).first()
+
+    @classmethod
+    async def afilter(cls, *args, **kwargs):
+        return await executor.read(cls.filter(*args, **kwargs).fetch_all)
+
+    @classmethod
+    async def afirst(cls, *args, **kwargs):
+        return await executor.read(cls.first, *args, **kwargs)
+
+    @classmethod
+    async def agetByPk(cls, pk):
+        return await executor.read(cls.getByPk, pk)
             
 
     @classmethod
     def getByPk(cls, pk):
-        sql = u"SELECT * FROM {0} WHERE id={1};".format(Utility.default_tb_name(cls), pk)
-        reg, d = Utility.execute_select(sql, Utility.default_db_name(cls))
+        obj = identity_get(cls, pk)
+        if obj is not None:
+            return obj
+        sql = u"SELECT * FROM {0} WHERE id=?;".format(Utility.default_tb_name(cls))
+        reg, d = Utility.select(sql, Utility.default_db_name(cls), (pk,))
         if len(reg) > 0:
-            reg = reg[0]
-            res = dict({k[0]: v for k, v in list(zip(d, reg))})
-            req_cls = cls()
-            req_cls.__cargar_datos__(**res)
-            return req_cls
+            obj = cls.load_row(d, reg[0])
+            identity_add(obj)
+            return obj
         return None
         
 
     @classmethod
     def get_schema(cls):
-        sql = "SELECT model FROM django_models_db WHERE table_name='%s';" % Utility.default_tb_name(cls)
-        reg, c = Utility.execute_select(sql, Utility.default_db_name(cls))
+        db_name = Utility.default_db_name(cls)
+        tb_name = Utility.default_tb_name(cls)
+        schema = schema_cache.get(db_name, tb_name)
+        if schema:
+            return schema
+        sql = "SELECT model FROM django_models_db WHERE table_name=?;"
+        reg, c = Utility.execute_select(sql, db_name, (tb_name,))
         if reg:
-            return json.loads(base64.b64decode(eval(reg[0][0])))
+            schema = json.loads(base64.b64decode(eval(reg[0][0])))
+            schema_cache.set(db_name, tb_name, schema)
+            return schema
         return None
 
     
     @classmethod
-    def delete_row(cls, **condition):
-        sql = "DELETE FROM {0} {1};".format(Utility.default_tb_name(cls), Utility.decode_condition(cls, **condition))
-        Utility.execute_query(sql, Utility.default_db_name(cls))
+    def delete_row(cls, *args, **condition):
+        return cls.filter(*args, **condition).delete()
 
     @classmethod
     def save_schema(cls, schema):
         schema_encode = base64.b64encode(json.dumps(schema).encode())
-        sql = u'INSERT OR REPLACE INTO django_models_db (table_name, model) VALUES ("{0}","{1}");'
-        sql = sql.format(Utility.default_tb_name(cls), schema_encode)
-        Utility.execute_query(sql, Utility.default_db_name(cls))
+        sql = u'INSERT OR REPLACE INTO django_models_db (table_name, model) VALUES (?, ?);'
+        Utility.execute_query(sql, Utility.default_db_name(cls),
+                              (Utility.default_tb_name(cls), str(schema_encode)))
+        schema_cache.set(Utility.default_db_name(cls), Utility.default_tb_name(cls), schema)
 
     @classmethod
     def create_table(cls, campos, fkData):
@@ -230,7 +486,8 @@ class Model(object):
         sql = u" ALTER TABLE {0} ADD COLUMN {1} REFERENCES {2}(id) ON DELETE CASCADE; "
         sql = sql.format(table_name, field.id_field_name, field.othermodel.__name__.lower())
         query.append(sql)
-        query.append("PRAGMA foreign_keys=on;")
+        foreign_keys = connections.get_pool(db_name).pragmas.get("foreign_keys", "OFF")
+        query.append("PRAGMA foreign_keys=%s;" % foreign_keys)
         Utility.execute_multiple_query(query, db_name)
 
     @classmethod
@@ -244,8 +501,36 @@ class Model(object):
        
         Utility.execute_multiple_query(query, db_name)
 
+    @classmethod
+    def get_indexes(cls):
+        indexes = []
+        for key in dir(cls):
+            field = getattr(cls, key)
+            tipo_class = getattr(field, 'tipo_class', "")
+            if tipo_class == constant.TIPO_CAMPO:
+                if field.unique:
+                    indexes.append(Index([key], unique=True))
+                elif field.db_index:
+                    indexes.append(Index([key]))
+            elif tipo_class == constant.TIPO_RELATION and field.class_name == "ForeignKey":
+                indexes.append(Index([key + "_id"]))
+        if hasattr(cls, "Meta"):
+            indexes.extend(getattr(cls.Meta, "indexes", []))
+        return indexes
+
+    @classmethod
+    def create_indexes(cls):
+        tb_name = Utility.default_tb_name(cls)
+        query = [index.toQuery(tb_name) for index in cls.get_indexes()]
+        for key in dir(cls):
+            field = getattr(cls, key)
+            if getattr(field, 'class_name', "") == "ManyToManyField":
+                query.extend(field.nexo_indexes(parent=cls))
+        Utility.execute_multiple_query(query, Utility.default_db_name(cls))
+
     @classmethod
     def init_model(cls):
+        schema_cache.invalidate(Utility.default_db_name(cls))
         if not Utility.exists_table("django_models_db", Utility.default_db_name(cls)):
             IDprimary = "id INTEGER PRIMARY KEY AUTOINCREMENT"
             sql = "CREATE TABLE IF NOT EXISTS django_models_db (%s, table_name TEXT UNIQUE, model TEXT);"
@@ -299,10 +584,10 @@ class Model(object):
                         schema["fields"].append({"field_name": field.id_field_name, "class_name": 'IntegerField'})
        
                     elif field.class_name == "ManyToManyField":
-                        model_nexo = Utility.default_tb_name(field.othermodel)+"_"+Utility.default_db_name(cls)
+                        model_nexo = Utility.default_tb_name(field.othermodel)+"_"+Utility.default_tb_name(cls)
                         serialized_field["model_nexo"] = model_nexo
                         serialized_field["id_foreignkey"] = cls.__name__.lower()+"_id"
-                        serialized_field["ohter_field_name"] = cls.__name__.lower()+"_set"
+                        serialized_field["other_field_name"] = cls.__name__.lower()+"_set"
                         othermodel_schema["relationship"].append({'othermodel': cls.__name__,
                                                                 'field_name': cls.__name__.lower()+"_set",
                                                                 'other_field_name': field.field_name,
@@ -320,5 +605,7 @@ class Model(object):
         if alter:
             cls.save_schema(schema)
 
+        cls.create_indexes()
+
 
 
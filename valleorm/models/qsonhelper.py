@@ -38,7 +38,7 @@ class HelperBase(object):
             isWordReserver = isWordReserver or col == 'query' or col == 'order'
             isWordReserver = isWordReserver or col == 'joins' or col == 'group'
             if isWordReserver:
-                decoder["condition"] = {key: val}
+                decoder["condition"][col] = val
             elif not isWordReserver and type(val) is dict :
                 child_decoder = self.decode_qson(val, col)
                 decoder['childs']["decoders"].append(child_decoder)
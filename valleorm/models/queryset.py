@@ -0,0 +1,412 @@
+from .tools import Utility, Q
+from .aio import executor, fetch_chunk
+from .cache import identity_clear, query_cache
+from .explain import explain_query
+
+
+def build_dict(d):
+    names = tuple(c[0] for c in d)
+    return lambda r: dict(zip(names, r))
+
+
+def build_tuple(d):
+    return lambda r: r
+
+
+def build_flat(d):
+    return lambda r: r[0]
+
+
+class QuerySet(object):
+    chunk_size = 500
+
+    def __init__(self, model, source=None):
+        self.model = model
+        self.tb_name = Utility.default_tb_name(model)
+        self.db_name = Utility.default_db_name(model)
+        self.source = source if source else self.tb_name
+        self.query = []
+        self.params = []
+        self.order = []
+        self.limit_value = None
+        self.offset_value = None
+        self.fields = None
+        self.builder = None
+        self.related = []
+        self.prefetch = []
+        self.annotations = []
+        self.group = []
+        self.result_cache = None
+        self.use_cache = None
+        self.cache_ttl = None
+
+    def clone(self):
+        qs = self.__class__(self.model, self.source)
+        qs.query = list(self.query)
+        qs.params = list(self.params)
+        qs.order = list(self.order)
+        qs.limit_value = self.limit_value
+        qs.offset_value = self.offset_value
+        qs.fields = self.fields
+        qs.builder = self.builder
+        qs.related = list(self.related)
+        qs.prefetch = list(self.prefetch)
+        qs.annotations = list(self.annotations)
+        qs.group = list(self.group)
+        qs.use_cache = self.use_cache
+        qs.cache_ttl = self.cache_ttl
+        return qs
+
+    def filter(self, *args, **kwargs):
+        qs = self.clone()
+        for arg in args:
+            if type(arg) == dict:
+                kwargs.update(arg)
+            elif isinstance(arg, Q):
+                qs.query.extend(arg.query)
+                qs.params.extend(arg.params)
+        if 'order' in kwargs:
+            qs.order = [kwargs.pop('order')]
+        if 'group' in kwargs:
+            qs.group = [kwargs.pop('group')]
+        if 'limit' in kwargs:
+            qs.limit_value = int(kwargs.pop('limit'))
+        if 'offset' in kwargs:
+            qs.offset_value = int(kwargs.pop('offset'))
+        query, params, op = Utility.split_condition(**kwargs)
+        qs.query.extend(query)
+        qs.params.extend(params)
+        return qs
+
+    def order_by(self, *fields):
+        qs = self.clone()
+        qs.order = []
+        for field in fields:
+            if field.startswith("-"):
+                qs.order.append("%s DESC" % field[1:])
+            else:
+                qs.order.append(field)
+        return qs
+
+    def limit(self, limit):
+        qs = self.clone()
+        qs.limit_value = limit
+        return qs
+
+    def offset(self, offset):
+        qs = self.clone()
+        qs.offset_value = offset
+        return qs
+
+    def cache(self, ttl=None, enabled=True):
+        qs = self.clone()
+        qs.use_cache = enabled
+        qs.cache_ttl = ttl
+        return qs
+
+    def select(self, sql, params):
+        return Utility.select(sql, self.db_name, params, self.use_cache, self.cache_ttl)
+
+    def values(self, *fields):
+        qs = self.clone()
+        qs.fields = fields if fields else None
+        qs.builder = build_dict
+        return qs
+
+    def values_list(self, *fields, flat=False):
+        if flat and len(fields) != 1:
+            raise ValueError("flat solo se puede usar con un campo")
+        qs = self.clone()
+        qs.fields = fields if fields else None
+        qs.builder = build_flat if flat else build_tuple
+        return qs
+
+    def annotate(self, *args, **kwargs):
+        qs = self.clone()
+        for agg in args:
+            qs.annotations.append((agg.default_alias(), agg))
+        for alias, agg in kwargs.items():
+            qs.annotations.append((alias, agg))
+        return qs
+
+    def aggregate(self, *args, **kwargs):
+        aggregates = [(agg.default_alias(), agg) for agg in args] + list(kwargs.items())
+        columns = ", ".join(["%s AS %s" % (agg.toQuery(self.tb_name), alias) for alias, agg in aggregates])
+        if self.limit_value is not None or self.offset_value is not None or self.group or self.annotations:
+            sql, params = self.sql()
+            sql = "SELECT {0} FROM ({1}) AS {2};".format(columns, sql[:-1], self.tb_name)
+        else:
+            sql = "SELECT {0} FROM {1}{2};".format(columns, self.source, self.where_sql())
+            params = self.params
+        reg, d = self.select(sql, params)
+        return dict(zip([alias for alias, agg in aggregates], reg[0]))
+
+    def select_related(self, *fields):
+        qs = self.clone()
+        for field in fields:
+            relation = self.relation(field)
+            if relation["class_name"] != "ForeignKey":
+                raise ValueError("select_related solo admite ForeignKey: %s" % field)
+            qs.related.append(field)
+        return qs
+
+    def prefetch_related(self, *fields):
+        qs = self.clone()
+        for field in fields:
+            self.relation(field)
+            qs.prefetch.append(field)
+        return qs
+
+    def relation(self, field):
+        compiled = self.model.compile_schema(self.model.get_schema())
+        for name, klass, proto in compiled.relations:
+            if name == field:
+                return proto
+        raise ValueError("%s no es una relacion de %s" % (field, self.model.__name__))
+
+    def related_columns(self):
+        columns = []
+        joins = []
+        for i, field in enumerate(self.related):
+            relation = self.relation(field)
+            othermodel = relation["othermodel"]
+            alias = "T%d" % (i + 1)
+            names = ["id"] + othermodel.compile_schema(othermodel.get_schema()).lstCampos
+            columns.append((field, othermodel, names))
+            joins.append(" LEFT JOIN {0} AS {1} ON {2}.{3}={1}.id".format(Utility.default_tb_name(othermodel), alias,
+                                                                        self.tb_name, field + "_id"))
+        return columns, joins
+
+    def model_fields(self):
+        return self.model.compile_schema(self.model.get_schema()).lstCampos
+
+    def only(self, *fields):
+        qs = self.clone()
+        qs.fields = ("id",) + tuple(f for f in fields if f != "id")
+        return qs
+
+    def defer(self, *fields):
+        qs = self.clone()
+        qs.fields = ("id",) + tuple(f for f in self.model_fields() if f not in fields)
+        return qs
+
+    def write_where_sql(self):
+        if self.source == self.tb_name and self.limit_value is None and self.offset_value is None:
+            return self.where_sql(), list(self.params)
+        sql, params = self.sql(columns="%s.id" % self.tb_name)
+        return " WHERE id IN (%s)" % sql[:-1], list(params)
+
+    def update(self, **fields):
+        keys = []
+        params = []
+        for k, v in fields.items():
+            keys.append(u"{0} = ?".format(k))
+            params.append(Utility.db_value(v))
+        where, where_params = self.write_where_sql()
+        sql = u"UPDATE {0} SET {1}{2};".format(self.tb_name, ", ".join(keys), where)
+        identity_clear(self.model)
+        return Utility.execute_query(sql, self.db_name, params + where_params)
+
+    def delete(self):
+        where, params = self.write_where_sql()
+        sql = u"DELETE FROM {0}{1};".format(self.tb_name, where)
+        identity_clear(self.model)
+        return Utility.execute_query(sql, self.db_name, params)
+
+    def where_sql(self):
+        if self.query:
+            return " WHERE %s" % " AND ".join(self.query)
+        return ""
+
+    def limit_sql(self):
+        op = ""
+        if self.limit_value is not None or self.offset_value is not None:
+            op += " LIMIT %d" % (self.limit_value if self.limit_value is not None else -1)
+        if self.offset_value is not None:
+            op += " OFFSET %d" % self.offset_value
+        return op
+
+    def sql(self, columns=None):
+        source = self.source
+        group = list(self.group)
+        rows = not columns
+        annotate = self.annotations and rows
+        aliases = [alias for alias, agg in self.annotations]
+        if rows and self.fields:
+            fields = ["%s.%s" % (self.tb_name, f) for f in self.fields if f not in aliases]
+            columns = ", ".join(fields)
+            if annotate and not group:
+                group = fields
+        elif rows:
+            columns = "%s.*" % self.tb_name
+            if annotate and not group:
+                group = ["%s.id" % self.tb_name]
+        if annotate:
+            columns = ", ".join([c for c in [columns] if c] +
+                                ["%s AS %s" % (agg.toQuery(self.tb_name), alias) for alias, agg in self.annotations])
+        if rows and self.related and not self.builder:
+            related, joins = self.related_columns()
+            for i, (field, othermodel, names) in enumerate(related):
+                columns += ", " + ", ".join(["T%d.%s" % (i + 1, name) for name in names])
+            source += "".join(joins)
+        sql = "SELECT {0} FROM {1}{2}".format(columns, source, self.where_sql())
+        if group:
+            sql += " GROUP BY %s" % ", ".join(group)
+        if self.order:
+            sql += " ORDER BY %s" % ", ".join(self.order)
+        return sql + self.limit_sql() + ";", self.params
+
+    def count(self):
+        if self.result_cache is not None:
+            return len(self.result_cache)
+        if self.limit_value is not None or self.offset_value is not None or self.group or self.annotations:
+            sql, params = self.sql()
+            sql = "SELECT COUNT(*) FROM (%s);" % sql[:-1]
+        else:
+            sql = "SELECT COUNT(*) FROM {0}{1};".format(self.source, self.where_sql())
+            params = self.params
+        reg, d = self.select(sql, params)
+        return reg[0][0]
+
+    def exists(self):
+        if self.result_cache is not None:
+            return len(self.result_cache) > 0
+        qs = self.clone()
+        qs.limit_value = 1
+        sql, params = qs.sql(columns="1")
+        reg, d = self.select(sql, params)
+        return len(reg) > 0
+
+    def first(self):
+        for obj in self.limit(1):
+            return obj
+        return None
+
+    def explain(self):
+        sql, params = self.sql()
+        return explain_query(sql, Utility.read_db_name(self.db_name), params)
+
+    def __iter__(self):
+        return iter(self.fetch_all())
+
+    def row_builder(self, d):
+        if self.builder:
+            return self.builder(d)
+        if not self.related:
+            return self.model.row_factory(d)
+
+        related, joins = self.related_columns()
+        end = len(d) - sum(len(names) for field, othermodel, names in related)
+        build_model = self.model.row_factory(d[:end])
+        parts = []
+        for field, othermodel, names in related:
+            start = end
+            end = start + len(names)
+            parts.append((field, start, end, othermodel.row_factory([(name,) for name in names])))
+        start_related = len(d) - sum(len(names) for field, othermodel, names in related)
+
+        def build(r):
+            obj = build_model(r[:start_related])
+            for field, start, end, build_related in parts:
+                sub = r[start:end]
+                getattr(obj, field).set_cache(build_related(sub) if sub[0] is not None else None)
+            return obj
+
+        return build
+
+    def iterator(self, chunk_size=None):
+        if self.prefetch and not self.builder:
+            chunk_size = min(chunk_size or Utility.max_variables, Utility.max_variables)
+        else:
+            chunk_size = chunk_size or self.chunk_size
+        sql, params = self.sql()
+        if self.use_cache or (self.use_cache is None and query_cache.enabled):
+            chunks = self.cached_objects(sql, params, chunk_size)
+        else:
+            chunks = Utility.execute_select_objects(sql, Utility.read_db_name(self.db_name), self.row_builder,
+                                                    params, chunk_size)
+        for objs in chunks:
+            if self.prefetch and not self.builder:
+                for field in self.prefetch:
+                    getattr(objs[0], field).prefetch(objs)
+            for obj in objs:
+                yield obj
+
+    def cached_objects(self, sql, params, chunk_size):
+        reg, d = self.select(sql, params)
+        if reg:
+            build = self.row_builder(d)
+            for rows in Utility.chunks(reg, chunk_size):
+                yield [build(r) for r in rows]
+
+    def fetch_all(self):
+        if self.result_cache is None:
+            self.result_cache = list(self.iterator())
+        return self.result_cache
+
+    def __len__(self):
+        return len(self.fetch_all())
+
+    def __bool__(self):
+        return self.exists()
+
+    def __getitem__(self, k):
+        if self.result_cache is not None:
+            return self.result_cache[k]
+        if isinstance(k, slice):
+            if k.step not in (None, 1):
+                return list(self)[k]
+            if (k.start is not None and k.start < 0) or (k.stop is not None and k.stop < 0):
+                return self.fetch_all()[k]
+            qs = self.clone()
+            start = k.start or 0
+            offset = (self.offset_value or 0) + start
+            limit = None if k.stop is None else max(k.stop - start, 0)
+            if self.limit_value is not None:
+                limit = max(self.limit_value - start, 0) if limit is None else min(limit, max(self.limit_value - start, 0))
+            qs.limit_value = limit
+            qs.offset_value = offset if offset else None
+            return qs
+        if k < 0:
+            return self.fetch_all()[k]
+        obj = self[k:k + 1].first()
+        if obj is None:
+            raise IndexError("QuerySet index out of range")
+        return obj
+
+    async def __aiter__(self):
+        for obj in await executor.read(self.fetch_all):
+            yield obj
+
+    async def aiterator(self, chunk_size=None):
+        iterator = self.iterator(chunk_size)
+        try:
+            while True:
+                chunk = await executor.read(fetch_chunk, iterator, chunk_size or self.chunk_size)
+                if not chunk:
+                    break
+                for obj in chunk:
+                    yield obj
+        finally:
+            iterator.close()
+
+    async def acount(self):
+        return await executor.read(self.count)
+
+    async def aexists(self):
+        return await executor.read(self.exists)
+
+    async def afirst(self):
+        return await executor.read(self.first)
+
+    async def aupdate(self, **fields):
+        return await executor.write(self.update, **fields)
+
+    async def adelete(self):
+        return await executor.write(self.delete)
+
+    async def aexplain(self):
+        return await executor.read(self.explain)
+
+    def __repr__(self):
+        return "<QuerySet %s>" % self.model.__name__
@@ -7,14 +7,18 @@
 # @Last modified time: 05-Sep-2017
 # @License: Apache license vesion 2.0
 
-import sys
 import inspect
 import importlib
 from . import constant
 from .tools import Utility
+from .queryset import QuerySet
+from .indexes import Index
+from .aio import executor, evaluate
 
 
 class __RelationShip__(object):
+    prefetched = False
+    cache = None
 
     def __init__(self, **options):
         self.tipo_class = constant.TIPO_RELATION
@@ -47,12 +51,29 @@ class __RelationShip__(object):
         return sql
     
 
+    def set_cache(self, value):
+        self.prefetched = True
+        self.cache = value
+
+    def clear_cache(self):
+        self.prefetched = False
+        self.cache = None
+
     def add(self, child):
         pass
 
     def get(self):
         return None
 
+    def prefetch(self, parents):
+        pass
+
+    async def aget(self, *args, **kwargs):
+        return await executor.read(lambda: evaluate(self.get(*args, **kwargs)))
+
+    async def aadd(self, child):
+        return await executor.write(self.add, child)
+
 
     id_field_name = property(get_id_field_name)
 
@@ -61,17 +82,30 @@ class OneToMany(__RelationShip__):
         super(OneToMany, self).__init__(**kargs)
         self.class_name = "OneToMany"
         if type(othermodel) == str:
-            self.othermodel =  getattr(sys.modules["__main__"], othermodel)
+            self.othermodel =  Utility.get_model(othermodel)
          
         
     def get(self, **condition):
+        if self.prefetched and not condition:
+            return self.cache
         condition["%s__fk" % self.id_foreignkey] = self.parent.id
-        return self.othermodel.find(**condition)
+        return self.othermodel.filter(**condition)
 
     def add(self, child):
         if self.parent != None:
             setattr(child, self.id_foreignkey, self.parent.id)
             child.save()
+            self.clear_cache()
+
+    def prefetch(self, parents):
+        childs = {}
+        ids = list(set(p.id for p in parents))
+        for chunk in Utility.chunks(ids):
+            condition = {"%s__in" % self.id_foreignkey: chunk}
+            for child in self.othermodel.filter(**condition):
+                childs.setdefault(getattr(child, self.id_foreignkey), []).append(child)
+        for p in parents:
+            getattr(p, self.field_name).set_cache(childs.get(p.id, []))
 
 class ForeignKey(__RelationShip__):
     def __init__(self, othermodel, on_delete, **kargs):
@@ -79,12 +113,23 @@ class ForeignKey(__RelationShip__):
         self.class_name = "ForeignKey"
         self.on_delete = on_delete
         if type(othermodel) == str:
-            self.othermodel =  getattr(sys.modules["__main__"], othermodel)
+            self.othermodel =  Utility.get_model(othermodel)
        
        
 
     def get(self):
-        return self.othermodel.getByPk(self.parent.id)
+        if self.prefetched:
+            return self.cache
+        return self.othermodel.getByPk(getattr(self.parent, self.id_field_name))
+
+    def prefetch(self, parents):
+        related = {}
+        ids = list(set(getattr(p, self.id_field_name) for p in parents))
+        for chunk in Utility.chunks(ids):
+            for obj in self.othermodel.filter(id__in=chunk):
+                related[obj.id] = obj
+        for p in parents:
+            getattr(p, self.field_name).set_cache(related.get(getattr(p, self.id_field_name)))
     
     
 class ManyToManyField(__RelationShip__):
@@ -94,7 +139,7 @@ class ManyToManyField(__RelationShip__):
         self.class_name = "ManyToManyField"
         self.othermodel = othermodel
         if type(othermodel) == str:
-            self.othermodel =  getattr(sys.modules["__main__"], othermodel)
+            self.othermodel =  Utility.get_model(othermodel)
         
 
 
@@ -110,28 +155,45 @@ class ManyToManyField(__RelationShip__):
 
         return sql
 
-    def get(self, *args, **kwargs):
-        kwargs["%s__fk" % self.id_foreignkey] = self.parent.id
-        other = self.othermodel()
-        column = ", ".join(other.lstCampos)
-        other_foreignkey = getattr(other, self.other_field_name).id_foreignkey
+    def nexo_indexes(self, parent):
+        name_other_tb = self.othermodel.__name__ .lower()
+        name_parent_tb = parent.__name__.lower()
+        model_nexo = name_other_tb+"_"+name_parent_tb
+        return [Index(["%s_id" % name_other_tb]).toQuery(model_nexo),
+                Index(["%s_id" % name_parent_tb]).toQuery(model_nexo)]
+
+    def source(self):
         other_tb_name = Utility.default_tb_name(self.othermodel)
-        sql = "SELECT {0} FROM {1} INNER JOIN {2} ON {1}.id=={2}.{3} {4}".format(column, other_tb_name, self.model_nexo, other_foreignkey,
-        Utility.decode_condition(self.parent, *args, **kwargs))
-        reg, d = Utility.execute_select(sql, Utility.default_db_name(self.othermodel))
-        registros = []
-        for r in reg:
-            res = dict({k[0]: v for k, v in list(zip(d, r))})
-            obj = self.othermodel()
-            obj.__cargar_datos__(**res)
-            registros.append(obj)
+        other_foreignkey = self.othermodel.__name__.lower() + "_id"
+        return "{0} INNER JOIN {1} ON {0}.id={1}.{2}".format(other_tb_name, self.model_nexo, other_foreignkey)
 
-        return registros
+    def get(self, *args, **kwargs):
+        if self.prefetched and not args and not kwargs:
+            return self.cache
+        kwargs["%s__fk" % self.id_foreignkey] = self.parent.id
+        return QuerySet(self.othermodel, self.source()).filter(*args, **kwargs)
+
+    def prefetch(self, parents):
+        childs = {}
+        ids = list(set(p.id for p in parents))
+        column = "%s.%s" % (self.model_nexo, self.id_foreignkey)
+        for chunk in Utility.chunks(ids):
+            qs = QuerySet(self.othermodel, self.source()).filter(**{"%s__in" % column: chunk})
+            sql, params = qs.sql(columns="%s.*, %s" % (qs.tb_name, column))
+            build = None
+            for rows, d in Utility.execute_select_iter(sql, Utility.read_db_name(qs.db_name), params,
+                                                       Utility.max_variables):
+                if build is None:
+                    build = self.othermodel.row_factory(d[:-1])
+                for r in rows:
+                    childs.setdefault(r[-1], []).append(build(r[:-1]))
+        for p in parents:
+            getattr(p, self.field_name).set_cache(childs.get(p.id, []))
 
 
     def add(self, child):
-        other = getattr(child, self.other_field_name)
-        sql = u"INSERT INTO {0} ({1}) VALUES ({2});".format(self.model_nexo,
-                                                            "%s, %s" % (other.id_foreignkey, self.id_foreignkey), 
-                                                            "%s, %s" % (child.id,self.parent.id))
-        Utility.execute_query(sql, Utility.default_db_name(self.othermodel))
\ No newline at end of file
+        other_foreignkey = self.othermodel.__name__.lower() + "_id"
+        sql = u"INSERT INTO {0} ({1}, {2}) VALUES (?, ?);".format(self.model_nexo, other_foreignkey,
+                                                                  self.id_foreignkey)
+        Utility.execute_query(sql, Utility.default_db_name(self.othermodel), (child.id, self.parent.id))
+        self.clear_cache()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+from .connection import connections
+
+
+def read_only_uri(path):
+    return "file:%s?mode=ro" % pathname2url(os.path.abspath(path))
+
+
+class Snapshot(object):
+    def __init__(self, primary, path=None, interval=60):
+        self.primary = primary
+        self.path = path or primary + ".snapshot"
+        self.interval = interval
+        self.name = read_only_uri(self.path)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.refreshed = None
+
+    def refresh(self):
+        with self.lock:
+            dst = sqlite3.connect(self.path)
+            try:
+                with connections.connection(self.primary) as src:
+                    src.backup(dst)
+                dst.execute("PRAGMA journal_mode=DELETE;")
+            finally:
+                dst.close()
+            self.refreshed = os.path.getmtime(self.path)
+
+    def start(self):
+        self.refresh()
+        if self.interval and self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name="valleorm-snapshot", daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        connections.close_all(self.name)
+
+
+class Router(object):
+    def __init__(self):
+        self.routes = {}
+        self.pending = {}
+        self.replicas = {}
+        self.lock = threading.Lock()
+
+    def route(self, model, db_name):
+        if isinstance(model, str):
+            from .tools import Utility
+            if model in Utility.models:
+                raise ValueError("El modelo %s ya esta definido, pase la clase a route()" % model)
+            with self.lock:
+                if db_name is None:
+                    self.pending.pop(model, None)
+                else:
+                    self.pending[model] = db_name
+            return
+        with self.lock:
+            if db_name is None:
+                self.routes.pop(model, None)
+            else:
+                self.routes[model] = db_name
+        model.__compiled__ = None
+
+    def claim(self, model):
+        with self.lock:
+            db_name = self.pending.pop(model.__name__, None)
+            if db_name is not None:
+                self.routes[model] = db_name
+
+    def add_replica(self, primary, replica):
+        with self.lock:
+            if replica is None:
+                self.replicas.pop(primary, None)
+            else:
+                self.replicas[primary] = replica
+
+    def db_for_model(self, model):
+        db_name = self.routes.get(model)
+        if db_name is not None:
+            return db_name
+        if hasattr(model, "DB_NAME"):
+            return model.DB_NAME
+        return "db.sqlite3"
+
+    def db_for_read(self, db_name):
+        replica = self.replicas.get(db_name)
+        if replica is None or connections.in_atomic_block(db_name):
+            return db_name
+        return replica if isinstance(replica, str) else replica.name
+
+
+router = Router()
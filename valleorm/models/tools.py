@@ -1,27 +1,87 @@
+import sys
 import sqlite3
 import base64
+import threading
+from contextlib import ContextDecorator
+from datetime import date, datetime
+from decimal import Decimal
 from . import constant
+from .connection import connections
+from .cache import schema_cache, query_cache
+from .instrumentation import instrumentation
+from .writer import writers
+from .router import router
 
 
 class Q(object):
     def __init__(self, **kwargs):
-        self.query, op = Utility.split_condition(**kwargs)
+        self.query, self.params, op = Utility.split_condition(**kwargs)
         
     def __str__(self):
         return " AND ".join(self.query)
 
     def __or__(self, other):
-        if type(other) == dict:
-            other = other["query"]
-        return {"query": str(self) + " OR " + str(other)}
+        return self.combine(other, "OR")
     
     def __and__(self, other):
+        return self.combine(other, "AND")
+
+    def combine(self, other, conector):
+        params = list(self.params)
         if type(other) == dict:
             other = other["query"]
-        return {"query": str(self) + " AND " + str(other)}
+        else:
+            params.extend(other.params)
+        q = Q()
+        q.query = ["(%s %s %s)" % (self, conector, other)]
+        q.params = params
+        return q
+
+
+class Atomic(ContextDecorator):
+    def __init__(self, using):
+        self.using = using
+        self.local = threading.local()
+
+    @property
+    def blocks(self):
+        blocks = getattr(self.local, "blocks", None)
+        if blocks is None:
+            blocks = self.local.blocks = []
+        return blocks
+
+    def __enter__(self):
+        block = connections.atomic(self.using)
+        self.blocks.append(block)
+        return block.__enter__()
+
+    def __exit__(self, *exc):
+        try:
+            return self.blocks.pop().__exit__(*exc)
+        finally:
+            query_cache.flush(self.using)
+
+    async def __aenter__(self):
+        from .aio import executor
+        return await executor.enter_atomic(self.__enter__)
+
+    async def __aexit__(self, *exc):
+        from .aio import executor
+        return await executor.exit_atomic(self.__exit__, *exc)
+
+
+def atomic(using="db.sqlite3"):
+    if not isinstance(using, str):
+        using = Utility.default_db_name(using)
+    return Atomic(using)
 
 
 class Utility:
+
+    models = {}
+    max_variables = 999
+    sql_cache = {}
+    sql_cache_size = 1024
     
     @staticmethod
     def default_tb_name(cls):
@@ -32,62 +92,213 @@ class Utility:
 
     @staticmethod
     def default_db_name(cls):
-        if hasattr(cls, "DB_NAME"):
-            return cls.DB_NAME
-        else:
-            return "db.sqlite3"
+        return router.db_for_model(cls)
+
+    @staticmethod
+    def read_db_name(db_name):
+        return router.db_for_read(db_name)
+
+    @staticmethod
+    def get_model(name):
+        if name in Utility.models:
+            return Utility.models[name]
+        return getattr(sys.modules["__main__"], name)
+
+    @staticmethod
+    def chunks(values, size=None):
+        size = size or Utility.max_variables
+        for i in range(0, len(values), size):
+            yield values[i:i+size]
+
+    @staticmethod
+    def cached_sql(key, builder):
+        sql = Utility.sql_cache.get(key)
+        if sql is None:
+            if len(Utility.sql_cache) >= Utility.sql_cache_size:
+                Utility.sql_cache.clear()
+            sql = Utility.sql_cache[key] = builder()
+        return sql
+
+    @staticmethod
+    def db_value(value):
+        if type(value) == bool:
+            return 1 if value else 0
+        elif isinstance(value, datetime):
+            return value.strftime('%m/%d/%y %H:%M:%S')
+        elif isinstance(value, date):
+            return value.strftime('%m/%d/%y')
+        elif isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    @staticmethod
+    def quote_value(value):
+        value = Utility.db_value(value)
+        if value is None:
+            return "NULL"
+        elif type(value) in (int, float):
+            return str(value)
+        return "'%s'" % str(value).replace("'", "''")
 
     @staticmethod
-    def execute_query(query, db_name):
+    def execute_query(query, db_name, params=()):
         if sqlite3.complete_statement(query):
-            db = sqlite3.connect(db_name)
+            writer = writers.get(db_name)
+            if writer is not None:
+                with instrumentation.query(query, db_name, params) as event:
+                    rowcount = event.rows = writer.execute("query", query, params)
+                query_cache.invalidate_sql(db_name, query)
+                return rowcount
+            with connections.connection(db_name) as db, instrumentation.query(query, db_name, params) as event:
+                cursor= db.cursor()
+                cursor.execute(query, params)
+                rowcount = event.rows = cursor.rowcount
+            query_cache.invalidate_sql(db_name, query)
+            return rowcount
+
+    @staticmethod
+    def execute_insert(query, db_name, params=()):
+        writer = writers.get(db_name)
+        if writer is not None:
+            with instrumentation.query(query, db_name, params) as event:
+                lastrowid = writer.execute("insert", query, params)
+                event.rows = 1
+            query_cache.invalidate_sql(db_name, query)
+            return lastrowid
+        with connections.connection(db_name) as db, instrumentation.query(query, db_name, params) as event:
+            cursor= db.cursor()
+            cursor.execute(query, params)
+            event.rows = cursor.rowcount
+            lastrowid = cursor.lastrowid
+        query_cache.invalidate_sql(db_name, query)
+        return lastrowid
+    
+    @staticmethod
+    def execute_many_insert(batches, db_name):
+        writer = writers.get(db_name)
+        if writer is not None:
+            with instrumentation.query(batches[0][0] if batches else "", db_name, batches) as event:
+                ids = writer.execute("many_insert", list(batches))
+                event.rows = len(ids)
+            for query, rows in batches:
+                query_cache.invalidate_sql(db_name, query)
+            return ids
+        ids = []
+        with connections.connection(db_name) as db:
+            cursor= db.cursor()
+            for query, rows in batches:
+                with instrumentation.query(query, db_name, rows) as event:
+                    cursor.executemany(query, rows)
+                    event.rows = cursor.rowcount
+                cursor.execute("SELECT last_insert_rowid();")
+                last = cursor.fetchone()[0]
+                ids.extend(range(last - len(rows) + 1, last + 1))
+        for query, rows in batches:
+            query_cache.invalidate_sql(db_name, query)
+        return ids
+    
+    @staticmethod
+    def execute_many(batches, db_name):
+        writer = writers.get(db_name)
+        if writer is not None:
+            with instrumentation.query(batches[0][0] if batches else "", db_name, batches) as event:
+                rowcount = event.rows = writer.execute("many", list(batches))
+            for query, rows in batches:
+                query_cache.invalidate_sql(db_name, query)
+            return rowcount
+        rowcount = 0
+        with connections.connection(db_name) as db:
             cursor= db.cursor()
-            cursor.execute(query)
-            db.commit()
-            db.close()
+            for query, rows in batches:
+                with instrumentation.query(query, db_name, rows) as event:
+                    cursor.executemany(query, rows)
+                    event.rows = cursor.rowcount
+                rowcount += cursor.rowcount
+        for query, rows in batches:
+            query_cache.invalidate_sql(db_name, query)
+        return rowcount
     
     @staticmethod
     def execute_multiple_query(query, db_name):
-        db = sqlite3.connect(db_name)
+        with connections.connection(db_name) as db:
+            for q in query:
+                if sqlite3.complete_statement(q):
+                    with instrumentation.query(q, db_name) as event:
+                        cursor= db.cursor()
+                        cursor.execute(q)
+                        event.rows = cursor.rowcount
         for q in query:
-            if sqlite3.complete_statement(q):
-                cursor= db.cursor()
-                cursor.execute(q)
-
-        db.commit()
-        db.close()
+            query_cache.invalidate_sql(db_name, q)
         
     @staticmethod
-    def execute_select(sql, db_name):
-        db = sqlite3.connect(db_name)
-        cursor= db.cursor()
-        cursor.execute(sql)
-        reg = cursor.fetchall()
-        d = cursor.description
-        db.commit()
-        db.close()
-        registros = []
+    def execute_select(sql, db_name, params=()):
+        with connections.connection(db_name) as db, instrumentation.query(sql, db_name, params) as event:
+            cursor= db.cursor()
+            cursor.execute(sql, params)
+            reg = cursor.fetchall()
+            d = cursor.description
+            event.rows = len(reg)
         return reg, d
 
+    @staticmethod
+    def select(sql, db_name, params=(), cache=None, ttl=None):
+        if cache is None:
+            cache = query_cache.enabled
+        read_db = router.db_for_read(db_name)
+        if not cache or connections.in_atomic_block(db_name):
+            return Utility.execute_select(sql, read_db, params)
+        return query_cache.get_or_set(sql, db_name, params,
+                                      lambda: Utility.execute_select(sql, read_db, params), ttl)
+
+    @staticmethod
+    def execute_select_iter(sql, db_name, params=(), chunk_size=100):
+        with connections.connection(db_name) as db, instrumentation.query(sql, db_name, params) as event:
+            cursor= db.cursor()
+            cursor.execute(sql, params)
+            d = cursor.description
+            event.rows = 0
+            reg = cursor.fetchmany(chunk_size)
+            while reg:
+                event.rows += len(reg)
+                event.suspend()
+                yield reg, d
+                event.resume()
+                reg = cursor.fetchmany(chunk_size)
+
+    @staticmethod
+    def execute_select_objects(sql, db_name, factory, params=(), chunk_size=500):
+        build = None
+        for reg, d in Utility.execute_select_iter(sql, db_name, params, chunk_size):
+            if build is None:
+                build = factory(d)
+            yield [build(r) for r in reg]
+
     @staticmethod
     def decode_condition(cls, *args, **kwargs):
         query = []
-        op = ""
+        params = []
         for arg in args:
             if type(arg) == dict:
                 kwargs.update(arg)
-        query, op = Utility.split_condition(**kwargs)
+            elif isinstance(arg, Q):
+                query.extend(arg.query)
+                params.extend(arg.params)
+        where, where_params, op = Utility.split_condition(**kwargs)
+        query.extend(where)
+        params.extend(where_params)
 
-        if query != "":
+        if query:
             query = "WHERE %s" % " AND ".join(query)
+        else:
+            query = ""
 
-        
-        return "{0} {1}".format(query, op)
+        return "{0} {1}".format(query, op), params
 
     @staticmethod
     def split_condition(**kwargs):
         query = []
-        op = ""
+        params = []
+        ops = {}
         
         for k, v in kwargs.items():
             if "__" in k:
@@ -96,72 +307,89 @@ class Utility:
                 action = os[1]
                 if action == "between": 
                     v1, v2 = v
-                    if type(v1) == str and type(v2) == str:
-                        v1 = "'%s'" % v1
-                        v2 = "'%s'" % v2
-                    query.append(" {0} BETWEEN {1}  AND {2} ".format(field, v1, v2))
+                    query.append(" {0} BETWEEN ? AND ? ".format(field))
+                    params.extend([Utility.db_value(v1), Utility.db_value(v2)])
                 elif action == "gte":
-                    if type(v) == str:
-                        v = "'%s'" % v
-                    query.append(" {1} >= {0} ".format(v, field))
+                    query.append(" {0} >= ? ".format(field))
+                    params.append(Utility.db_value(v))
                 elif action ==  "lte":
-                    if type(v) == str:
-                        v = "'%s'" % v
-                    query.append(" {1} <= {0} ".format(v, field))
+                    query.append(" {0} <= ? ".format(field))
+                    params.append(Utility.db_value(v))
                 elif action == "start":
-                    query.append(" {1} LIKE '{0}%' ".format(v, field))
+                    query.append(" {0} LIKE ? ".format(field))
+                    params.append("%s%%" % v)
                 elif action == "end":
-                    query.append(" {1} LIKE '%{0}' ".format(v, field))
+                    query.append(" {0} LIKE ? ".format(field))
+                    params.append("%%%s" % v)
                 elif action == "contain":
-                    query.append(" {1} LIKE '%{0}%' ".format(v, field))     
+                    query.append(" {0} LIKE ? ".format(field))
+                    params.append("%%%s%%" % v)
+                elif action == "in":
+                    v = [Utility.db_value(x) for x in v]
+                    query.append(" {0} IN ({1}) ".format(field, ", ".join(["?"] * len(v))))
+                    params.extend(v)
+                elif action == "fk":
+                    query.append(" {0}=? ".format(field))
+                    params.append(v)
+                else:
+                    raise ValueError("Condicion desconocida: %s" % k)
             elif "query" in k:
-                query.append(v)
-            elif k in ['limit', 'offset', 'order']:
-                if k == 'order':
-                    k = "ORDER BY"
-                op += " %s %s " % (k,v)
+                if isinstance(v, Q):
+                    query.extend(v.query)
+                    params.extend(v.params)
+                else:
+                    query.append(v)
+            elif k in ['limit', 'offset', 'order', 'group']:
+                ops[k] = v
             elif k in ["id", "pk"]:
-                query.append("id=%s" % v)
+                query.append("id=?")
+                params.append(v)
             else:
-                if type(v) == str:
-                    v = "'%s'" % v
-                query.append(" %s=%s " % (k, v))
-        return query, op
+                query.append(" %s=? " % k)
+                params.append(Utility.db_value(v))
+
+        op = ""
+        if 'group' in ops:
+            op += " GROUP BY %s " % ops['group']
+        if 'order' in ops:
+            op += " ORDER BY %s " % ops['order']
+        if 'limit' in ops or 'offset' in ops:
+            op += " LIMIT %d " % int(ops.get('limit', -1))
+        if 'offset' in ops:
+            op += " OFFSET %d " % int(ops['offset'])
+        return query, params, op
 
     @staticmethod
     def drop_db(dbName="db.sqlite3"):
         sql = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE '%sqlite%';"
-        db = sqlite3.connect(dbName)
-        cursor= db.cursor()
-        cursor.execute(sql)
-        reg = cursor.fetchall()
-        for r in reg:
-            cursor.execute("DROP TABLE %s;" % r)
-        db.commit()
-        db.close()
+        with connections.connection(dbName) as db:
+            cursor= db.cursor()
+            with instrumentation.query(sql, dbName) as event:
+                cursor.execute(sql)
+                reg = cursor.fetchall()
+                event.rows = len(reg)
+            for r in reg:
+                with instrumentation.query("DROP TABLE %s;" % r, dbName):
+                    cursor.execute("DROP TABLE %s;" % r)
+        schema_cache.invalidate(dbName)
+        query_cache.invalidate(dbName)
 
     @staticmethod
     def exists_table(table_name, dbName):
-        sql = "SELECT name FROM sqlite_master WHERE type='table' AND name='%s';"
-        sql = sql % table_name
-        db = sqlite3.connect(dbName)
-        cursor= db.cursor()
-        cursor.execute(sql)
-        reg = cursor.fetchone()
-        db.commit()
-        db.close()
+        sql = "SELECT name FROM sqlite_master WHERE type='table' AND name=?;"
+        with connections.connection(dbName) as db, instrumentation.query(sql, dbName, (table_name,)) as event:
+            cursor= db.cursor()
+            cursor.execute(sql, (table_name,))
+            reg = cursor.fetchone()
+            event.rows = 0 if reg is None else 1
         return reg != None
 
     @staticmethod
     def alter_model(table_name, schema, dbName):
         import json
-        strModel = base64.b64encode(json.dumps(schema))
-        sql = u'INSERT OR REPLACE INTO django_models_db (table_name, model) VALUES ("{0}","{1}");'
-        sql = sql.format(table_name, strModel)
-        db = sqlite3.connect(dbName)
-        cursor= db.cursor()
-        cursor.execute(sql)
-        db.commit()
-        db.close()
+        strModel = base64.b64encode(json.dumps(schema).encode())
+        sql = u'INSERT OR REPLACE INTO django_models_db (table_name, model) VALUES (?, ?);'
+        Utility.execute_query(sql, dbName, (table_name, str(strModel)))
+        schema_cache.invalidate(dbName, table_name)
 
    
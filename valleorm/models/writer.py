@@ -0,0 +1,266 @@
+import os
+import time
+import queue
+import pickle
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+from .connection import connections
+
+
+class WriterError(Exception):
+    pass
+
+
+def apply_request(db, op, payload, params):
+    cursor = db.cursor()
+    if op == "query":
+        cursor.execute(payload, params)
+        return cursor.rowcount
+    elif op == "insert":
+        cursor.execute(payload, params)
+        return cursor.lastrowid
+    elif op == "many":
+        rowcount = 0
+        for query, rows in payload:
+            cursor.executemany(query, rows)
+            rowcount += cursor.rowcount
+        return rowcount
+    elif op == "many_insert":
+        ids = []
+        for query, rows in payload:
+            cursor.executemany(query, rows)
+            cursor.execute("SELECT last_insert_rowid();")
+            last = cursor.fetchone()[0]
+            ids.extend(range(last - len(rows) + 1, last + 1))
+        return ids
+    raise WriterError("Operacion desconocida: %s" % op)
+
+
+class WriterService(object):
+    def __init__(self, db_name, address=None, authkey=None, max_batch=500, max_delay=0.005):
+        self.db_name = db_name
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.listener = None
+        self.threads = []
+        self.running = False
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.processed = 0
+
+    def start(self):
+        with self.lock:
+            self.running = True
+        thread = threading.Thread(target=self.run, name="valleorm-writer", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        if self.address is not None:
+            self.listener = Listener(self.address, authkey=self.authkey)
+            self.address = self.listener.address
+            thread = threading.Thread(target=self.accept, name="valleorm-writer-listener", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        with self.lock:
+            if not self.threads:
+                return
+            self.running = False
+            self.requests.put(None)
+        if self.listener is not None:
+            try:
+                Client(self.address, authkey=self.authkey).close()
+            except OSError:
+                pass
+        for thread in self.threads:
+            thread.join(timeout=5)
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        self.threads = []
+
+    def submit(self, op, payload, params=()):
+        future = Future()
+        with self.lock:
+            if self.running:
+                self.requests.put((future, op, payload, params))
+                return future
+        future.set_exception(WriterError("El writer no esta arrancado"))
+        return future
+
+    def execute(self, op, payload, params=()):
+        return self.submit(op, payload, params).result()
+
+    def run(self):
+        try:
+            stop = False
+            while not stop:
+                item = self.requests.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self.requests.get_nowait()
+                    except queue.Empty:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        try:
+                            item = self.requests.get(timeout=remaining)
+                        except queue.Empty:
+                            break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                try:
+                    self.commit(batch)
+                except Exception as e:
+                    self.fail(batch, e)
+                except BaseException:
+                    self.fail(batch, WriterError("El writer se ha detenido"))
+                    raise
+        finally:
+            with self.lock:
+                self.running = False
+            self.fail_pending()
+
+    def fail(self, batch, error):
+        for future, op, payload, params in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def fail_pending(self):
+        while True:
+            try:
+                item = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self.fail([item], WriterError("El writer se ha detenido"))
+
+    def commit(self, batch):
+        results = []
+        pool = connections.get_pool(self.db_name)
+        db = None
+        try:
+            db = pool.acquire()
+            if db.in_transaction:
+                db.commit()
+            db.execute("BEGIN IMMEDIATE;")
+            for future, op, payload, params in batch:
+                db.execute("SAVEPOINT valleorm_writer;")
+                try:
+                    result = apply_request(db, op, payload, params)
+                except Exception as e:
+                    db.execute("ROLLBACK TO valleorm_writer;")
+                    db.execute("RELEASE valleorm_writer;")
+                    results.append((False, e))
+                else:
+                    db.execute("RELEASE valleorm_writer;")
+                    results.append((True, result))
+            db.commit()
+        except Exception as e:
+            if db is not None and db.in_transaction:
+                db.rollback()
+            results = [(False, e)] * len(batch)
+        finally:
+            if db is not None:
+                pool.release(db)
+
+        self.batches += 1
+        self.processed += len(batch)
+        for (future, op, payload, params), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def accept(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError):
+                if not self.running:
+                    break
+                continue
+            if not self.running:
+                conn.close()
+                break
+            thread = threading.Thread(target=self.serve, args=(conn,), name="valleorm-writer-client", daemon=True)
+            thread.start()
+
+    def serve(self, conn):
+        try:
+            while self.running:
+                try:
+                    op, payload, params = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    reply = (True, self.execute(op, payload, params))
+                except Exception as e:
+                    reply = (False, e)
+                try:
+                    conn.send(reply)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    conn.send((False, WriterError(repr(reply[1]))))
+        finally:
+            conn.close()
+
+
+class WriterClient(object):
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.local.conn = Client(self.address, authkey=self.authkey)
+            self.local.pid = os.getpid()
+        return conn
+
+    def execute(self, op, payload, params=()):
+        conn = self.connection()
+        conn.send((op, payload, params))
+        ok, value = conn.recv()
+        if not ok:
+            raise value
+        return value
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+class WriterRegistry(object):
+    def __init__(self):
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def configure(self, db_name, writer):
+        with self.lock:
+            if writer is None:
+                self.writers.pop(db_name, None)
+            else:
+                self.writers[db_name] = writer
+
+    def get(self, db_name):
+        writer = self.writers.get(db_name)
+        if writer is None or connections.in_atomic_block(db_name):
+            return None
+        return writer
+
+
+writers = WriterRegistry()